@@ -401,7 +401,7 @@ def main():
     print("  📝 Create commit logs in docs/commit-logs/")
     print("  📊 Generate git timeline reports")
     print("  🔄 Update README with latest commits")
-    print("  🔒 Prevent recursive commits with lock files")
+    print("  🔒 Queue commits so none are skipped while the hook is busy")
     print()
     
     if hook_kept_existing and hook_status == 1:
@@ -411,6 +411,9 @@ def main():
     
     print("Environment variables:")
     print("  GIT_AUTO_PUSH=true  - Enable automatic push after commits")
+    print("  GIT_HOOKS_ASYNC=true  - Process commits in a background worker")
+    print("  TIMELINE_FULL_REBUILD=true  - Rebuild the git timeline from scratch")
+    print("  TIMELINE_SHARD=month|<N>  - Split the timeline into monthly or N-commit pages")
     print()
     print("To test the hooks, make a commit:")
     print("  git add .")
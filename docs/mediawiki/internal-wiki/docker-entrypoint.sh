@@ -27,6 +27,10 @@ if [ -d /var/www/html/content ] && [ -z "$(mysql -h"$MEDIAWIKI_DB_HOST" -u"$MEDI
         fi
     done
     
+    # Refresh the counters and recent changes that importDump.php leaves alone
+    php /var/www/html/maintenance/initSiteStats.php --update
+    php /var/www/html/maintenance/rebuildrecentchanges.php
+
     # Rebuild search index after import
     php /var/www/html/maintenance/rebuildtextindex.php
 fi
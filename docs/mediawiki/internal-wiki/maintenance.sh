@@ -25,9 +25,18 @@ case "$1" in
         docker exec -it github-wiki php /var/www/html/maintenance/createAndPromote.php --force --sysop --custom-groups=admin "$username" "$password"
         ;;
     
+    "build-import")
+        echo "Building XML dump from content and templates..."
+        WIKI_DIR="$(cd "$(dirname "$0")" && pwd)"
+        python3 "$WIKI_DIR/../sync-content.py" --export-xml "$WIKI_DIR/content/wiki-import.xml" \
+            --content-dir "$WIKI_DIR/content" --templates-dir "$WIKI_DIR/templates"
+        ;;
+    
     "import-content")
         echo "Importing wiki content..."
         docker exec -it github-wiki bash -c 'for file in /var/www/html/content/*.xml; do php /var/www/html/maintenance/importDump.php < "$file"; done'
+        docker exec -it github-wiki php /var/www/html/maintenance/initSiteStats.php --update
+        docker exec -it github-wiki php /var/www/html/maintenance/rebuildrecentchanges.php
         ;;
     
     "export-content")
@@ -42,7 +51,7 @@ case "$1" in
         ;;
     
     *)
-        echo "Usage: $0 {rebuild-search|update-db|create-admin|import-content|export-content|clear-cache}"
+        echo "Usage: $0 {rebuild-search|update-db|create-admin|build-import|import-content|export-content|clear-cache}"
         exit 1
         ;;
 esac
@@ -12,27 +12,349 @@ import requests
 import json
 import time
 import hashlib
+import re
+import ctypes
+import ctypes.util
+import select
+import struct
+import tempfile
+import threading
+import gzip
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, List, NamedTuple, Optional
 import argparse
-from datetime import datetime
+from datetime import datetime, timezone
+from xml.sax.saxutils import escape
+from requests.adapters import HTTPAdapter
+
+# MediaWiki error codes that mean "try again later"
+RETRYABLE_ERRORS = ('maxlag', 'ratelimited')
+RETRYABLE_STATUS = (429, 503)
+# Edit errors fixed by a new CSRF token, or by logging in again
+TOKEN_ERRORS = ('badtoken',)
+SESSION_ERRORS = ('assertuserfailed', 'assertnameduserfailed', 'notloggedin')
+# Page text from this size on is sent as multipart/form-data instead of URL-encoded
+MULTIPART_MIN_BYTES = 8 * 1024
+# Request bodies from this size on are gzip-compressed when --gzip-requests is set
+GZIP_MIN_BYTES = 4 * 1024
+# Version 3: BLAKE2b hashes of the raw file bytes, stat fingerprints and transcluded titles
+STATE_VERSION = 3
+# Maximum number of titles per action=query request for normal users
+QUERY_BATCH_SIZE = 50
+TEMPLATE_FILE_PREFIX = 'Template_'
+# MediaWiki 1.39 reads export schema 0.11
+EXPORT_NAMESPACE = 'http://www.mediawiki.org/xml/export-0.11/'
+TEMPLATE_NAMESPACE_ID = 10
+# Upper bounds (seconds) of the request latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Markup whose {{...}} is not a transclusion of the page itself
+NON_TRANSCLUDED = re.compile(
+    r'<!--.*?-->|<(nowiki|pre|syntaxhighlight|source|noinclude)\b.*?</\1\s*>',
+    re.DOTALL | re.IGNORECASE
+)
+# Skips {{{parameters}}} and ${{ expressions }} from GitHub Actions examples
+TRANSCLUSION = re.compile(r'(?<![{$])\{\{(?!\{)\s*([^{}|#<>\[\]\n]+?)\s*(?:\||\}\})')
+
+class LocalFile(NamedTuple):
+    fingerprint: List[int]
+    content: str
+    hash: str
+
+class SyncMetrics:
+    """Thread-safe counters and timers for one sync run
+    
+    Phase times are summed over worker threads, so with several workers they
+    can add up to more than the wall time.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.phases: Dict[str, dict] = {}
+        self.requests: Dict[str, dict] = {}
+        self.pages: Dict[str, int] = {}
+        self.bytes_sent = 0
+        self.retries = 0
+    
+    @contextmanager
+    def phase(self, name: str):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - start
+            with self.lock:
+                phase = self.phases.setdefault(name, {'seconds': 0.0, 'count': 0})
+                phase['seconds'] += elapsed
+                phase['count'] += 1
+    
+    def record_request(self, action: str, seconds: float, body_size: int):
+        with self.lock:
+            request = self.requests.setdefault(action, {
+                'count': 0, 'seconds': 0.0, 'buckets': [0] * (len(LATENCY_BUCKETS) + 1)
+            })
+            request['count'] += 1
+            request['seconds'] += seconds
+            bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound), len(LATENCY_BUCKETS))
+            request['buckets'][bucket] += 1
+            self.bytes_sent += body_size
+    
+    def count_page(self, result: str):
+        with self.lock:
+            self.pages[result] = self.pages.get(result, 0) + 1
+    
+    def count_retry(self):
+        with self.lock:
+            self.retries += 1
+    
+    def summary(self) -> dict:
+        with self.lock:
+            requests_summary = {}
+            for action, request in self.requests.items():
+                cumulative = 0
+                buckets = {}
+                for bound, count in zip([*map(str, LATENCY_BUCKETS), '+Inf'], request['buckets']):
+                    cumulative += count
+                    buckets[bound] = cumulative
+                requests_summary[action] = {
+                    'count': request['count'],
+                    'seconds': round(request['seconds'], 6),
+                    'buckets': buckets,
+                }
+            return {
+                'wall_seconds': round(time.monotonic() - self.started, 6),
+                'phases': {name: {'seconds': round(phase['seconds'], 6), 'count': phase['count']}
+                           for name, phase in self.phases.items()},
+                'requests': requests_summary,
+                'bytes_sent': self.bytes_sent,
+                'pages': dict(self.pages),
+                'retries': self.retries,
+            }
+    
+    def to_json(self) -> str:
+        return json.dumps(self.summary(), indent=2)
+    
+    def to_prometheus(self) -> str:
+        """Render the summary in the Prometheus text exposition format"""
+        summary = self.summary()
+        lines = [
+            '# TYPE mediawiki_sync_wall_seconds gauge',
+            f"mediawiki_sync_wall_seconds {summary['wall_seconds']}",
+            '# TYPE mediawiki_sync_phase_seconds_total counter',
+        ]
+        for name, phase in sorted(summary['phases'].items()):
+            lines.append(f'mediawiki_sync_phase_seconds_total{{phase="{name}"}} {phase["seconds"]}')
+        lines.append('# TYPE mediawiki_sync_request_duration_seconds histogram')
+        for action, request in sorted(summary['requests'].items()):
+            for bound, count in request['buckets'].items():
+                lines.append(f'mediawiki_sync_request_duration_seconds_bucket{{action="{action}",le="{bound}"}} {count}')
+            lines.append(f'mediawiki_sync_request_duration_seconds_sum{{action="{action}"}} {request["seconds"]}')
+            lines.append(f'mediawiki_sync_request_duration_seconds_count{{action="{action}"}} {request["count"]}')
+        lines.append('# TYPE mediawiki_sync_bytes_sent_total counter')
+        lines.append(f"mediawiki_sync_bytes_sent_total {summary['bytes_sent']}")
+        lines.append('# TYPE mediawiki_sync_pages_total counter')
+        for result, count in sorted(summary['pages'].items()):
+            lines.append(f'mediawiki_sync_pages_total{{result="{result}"}} {count}')
+        lines.append('# TYPE mediawiki_sync_retries_total counter')
+        lines.append(f"mediawiki_sync_retries_total {summary['retries']}")
+        return '\n'.join(lines) + '\n'
+    
+    def write(self, json_path: Optional[str] = None, prometheus_path: Optional[str] = None):
+        """Write the JSON and/or Prometheus output; '-' means stdout"""
+        for path, text in ((json_path, self.to_json), (prometheus_path, self.to_prometheus)):
+            if not path:
+                continue
+            if path == '-':
+                print(text())
+            else:
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(text())
 
 class MediaWikiSync:
-    def __init__(self, wiki_url: str, username: str, password: str):
+    def __init__(self, wiki_url: str, username: str, password: str,
+                 workers: int = 4, maxlag: int = 5, max_retries: int = 5,
+                 state_file: Optional[str] = None, remote_diff: bool = True,
+                 templates_dir: Optional[str] = None, purge: bool = True,
+                 session_file: Optional[str] = None, gzip_requests: bool = False):
         self.wiki_url = wiki_url.rstrip('/')
         self.api_url = f"{self.wiki_url}/api.php"
         self.username = username
         self.password = password
+        self.workers = max(1, workers)
+        self.maxlag = maxlag
+        self.max_retries = max_retries
         self.session = requests.Session()
+        # Keep one pooled connection per worker so parallel edits reuse connections
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
         self.csrf_token = None
-        self.content_hashes = {}
+        # Cookies are cached between runs; the lock lets one worker refresh an expired session
+        self.session_file = session_file
+        self.session_lock = threading.Lock()
+        self.session_generation = 0
+        # Only for servers that decompress request bodies (e.g. a Content-Encoding aware proxy)
+        self.gzip_requests = gzip_requests
+        self.metrics = SyncMetrics()
+        # Per page title: content hash, fingerprint, transcluded titles, text SHA1, revision id and timestamp
+        self.state_file = state_file
+        self.page_state: Dict[str, dict] = {}
+        self.state_changed = False
+        # Titles that got a new revision in the current sync_paths() run
+        self.edited_titles = set()
+        self.remote_diff = remote_diff
+        self.templates_dir = templates_dir
+        self.purge = purge
+        self.load_state()
+        
+    def load_state(self):
+        """Load the sync state written by a previous run, if it belongs to this wiki"""
+        if not self.state_file or not os.path.exists(self.state_file):
+            return
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️  Ignoring unreadable sync state {self.state_file}: {e}")
+            return
+        if state.get('version') != STATE_VERSION or state.get('wiki_url') != self.wiki_url:
+            print(f"⚠️  Sync state {self.state_file} is for another wiki or version, ignoring it")
+            return
+        self.page_state = state.get('pages', {})
+        print(f"📂 Loaded sync state for {len(self.page_state)} pages")
+    
+    def save_state(self):
+        """Write the sync state atomically so an interrupted run never leaves a broken file"""
+        if not self.state_file or not self.state_changed:
+            return
+        state = {'version': STATE_VERSION, 'wiki_url': self.wiki_url, 'pages': self.page_state}
+        state_dir = os.path.dirname(os.path.abspath(self.state_file))
+        fd, tmp_path = tempfile.mkstemp(dir=state_dir, prefix='.sync-state.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(state, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.state_file)
+            self.state_changed = False
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        
+    def send(self, data: dict, multipart: bool = False) -> requests.Response:
+        """POST one API request and record its latency and size
+        
+        ``multipart`` sends the fields as multipart/form-data, which avoids the
+        percent-encoding overhead of wikitext in large pages.
+        """
+        action = data['action']
+        if action == 'query':
+            action = f"query:{data.get('meta') or data.get('prop') or 'other'}"
+        if multipart:
+            request = requests.Request('POST', self.api_url, files={
+                name: (None, str(value)) for name, value in data.items()
+            })
+        else:
+            request = requests.Request('POST', self.api_url, data=data)
+        prepared = self.session.prepare_request(request)
+        body = prepared.body or b''
+        if self.gzip_requests and len(body) >= GZIP_MIN_BYTES:
+            body = gzip.compress(body.encode('utf-8') if isinstance(body, str) else body)
+            prepared.body = body
+            prepared.headers['Content-Encoding'] = 'gzip'
+            prepared.headers['Content-Length'] = str(len(body))
+        settings = self.session.merge_environment_settings(prepared.url, {}, None, None, None)
+        start = time.monotonic()
+        response = self.session.send(prepared, **settings)
+        self.metrics.record_request(action, time.monotonic() - start, len(body))
+        return response
+    
+    def post_api(self, data: dict, multipart: bool = False) -> requests.Response:
+        """POST to the API, backing off on maxlag, rate limits and 429/503 responses"""
+        data = {**data, 'maxlag': self.maxlag} if self.maxlag else data
+        delay = 1.0
+        for attempt in range(self.max_retries + 1):
+            response = self.send(data, multipart)
+            retry_after = response.headers.get('Retry-After')
+            if response.status_code in RETRYABLE_STATUS:
+                reason = f"HTTP {response.status_code}"
+            elif response.status_code == 200:
+                try:
+                    error = response.json().get('error', {}).get('code')
+                except ValueError:
+                    error = None
+                if error not in RETRYABLE_ERRORS:
+                    return response
+                reason = error
+            else:
+                return response
+            if attempt == self.max_retries:
+                break
+            wait = float(retry_after) if retry_after and retry_after.isdigit() else delay
+            print(f"⏳ Server busy ({reason}), retrying {data.get('title', data['action'])} in {wait:.0f}s")
+            self.metrics.count_retry()
+            time.sleep(wait)
+            delay = min(delay * 2, 60)
+        return response
+    
+    def load_session(self) -> bool:
+        """Restore cached cookies and check them with a single userinfo + token request"""
+        if not self.session_file or not os.path.exists(self.session_file):
+            return False
+        try:
+            with open(self.session_file, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if cached.get('wiki_url') != self.wiki_url or cached.get('username') != self.username:
+            return False
+        for cookie in cached.get('cookies', []):
+            self.session.cookies.set(**cookie)
+        
+        response = self.send({
+            'action': 'query',
+            'meta': 'userinfo|tokens',
+            'format': 'json'
+        })
+        if response.status_code != 200:
+            return False
+        query = response.json().get('query', {})
+        if 'anon' in query.get('userinfo', {'anon': ''}) or 'csrftoken' not in query.get('tokens', {}):
+            # Expired: start from a clean cookie jar
+            self.session.cookies.clear()
+            return False
+        self.csrf_token = query['tokens']['csrftoken']
+        print(f"✅ Reusing cached session for {query['userinfo'].get('name', self.username)}")
+        return True
+    
+    def save_session(self):
+        """Cache the session cookies (readable by the owner only) for the next run"""
+        if not self.session_file:
+            return
+        cookies = [
+            {'name': c.name, 'value': c.value, 'domain': c.domain, 'path': c.path}
+            for c in self.session.cookies
+        ]
+        cached = {'wiki_url': self.wiki_url, 'username': self.username, 'cookies': cookies}
+        session_dir = os.path.dirname(os.path.abspath(self.session_file))
+        fd, tmp_path = tempfile.mkstemp(dir=session_dir, prefix='.sync-session.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(cached, f, indent=2)
+            os.replace(tmp_path, self.session_file)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    
+    def login(self, use_cache: bool = True) -> bool:
+        """Login to MediaWiki and get CSRF token, reusing a cached session when it is still valid"""
+        if use_cache and self.load_session():
+            return True
         
-    def login(self) -> bool:
-        """Login to MediaWiki and get CSRF token"""
         print(f"🔐 Logging into MediaWiki at {self.wiki_url}")
         
         # Get login token
-        response = self.session.post(self.api_url, data={
+        response = self.send({
             'action': 'query',
             'meta': 'tokens',
             'type': 'login',
@@ -51,7 +373,7 @@ class MediaWikiSync:
         login_token = data['query']['tokens']['logintoken']
         
         # Login
-        response = self.session.post(self.api_url, data={
+        response = self.send({
             'action': 'login',
             'lgname': self.username,
             'lgpassword': self.password,
@@ -70,8 +392,15 @@ class MediaWikiSync:
             
         print("✅ Successfully logged in")
         
-        # Get CSRF token for editing
-        response = self.session.post(self.api_url, data={
+        if not self.refresh_token():
+            return False
+        print("✅ CSRF token obtained")
+        self.save_session()
+        return True
+    
+    def refresh_token(self) -> bool:
+        """Get a new CSRF token for editing"""
+        response = self.send({
             'action': 'query',
             'meta': 'tokens',
             'format': 'json'
@@ -80,87 +409,340 @@ class MediaWikiSync:
         if response.status_code == 200:
             data = response.json()
             self.csrf_token = data['query']['tokens']['csrftoken']
-            print("✅ CSRF token obtained")
             return True
         else:
             print("❌ Failed to get CSRF token")
             return False
     
+    def renew_session(self, error: str, generation: int) -> bool:
+        """Recover from an expired token or session reported by an edit
+        
+        Workers that hit the same error wait on the lock; whoever comes second
+        sees the session was already renewed since its request and just retries.
+        """
+        with self.session_lock:
+            if self.session_generation != generation:
+                return True
+            if error in TOKEN_ERRORS:
+                print("🔑 CSRF token expired, getting a new one")
+                renewed = self.refresh_token()
+            else:
+                print("🔐 Session expired, logging in again")
+                self.session.cookies.clear()
+                renewed = self.login(use_cache=False)
+            if renewed:
+                self.session_generation += 1
+            return renewed
+    
     def get_file_hash(self, file_path: str) -> str:
-        """Get MD5 hash of file content"""
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        return hashlib.md5(content.encode('utf-8')).hexdigest()
+        """Get BLAKE2b hash of the raw file content"""
+        with open(file_path, 'rb') as f:
+            return self.hash_bytes(f.read())
+    
+    def hash_bytes(self, data: bytes) -> str:
+        return hashlib.blake2b(data, digest_size=16).hexdigest()
+    
+    def get_fingerprint(self, file_path: str) -> List[int]:
+        """Cheap change indicator: (mtime_ns, size, inode) from a single stat call"""
+        stat = os.stat(file_path)
+        return [stat.st_mtime_ns, stat.st_size, stat.st_ino]
+    
+    def read_if_changed(self, file_path: str, title: str, force: bool = False) -> Optional[LocalFile]:
+        """Read a file once, unless the sync state shows it is unchanged
+        
+        A matching fingerprint skips the read entirely. If only the fingerprint
+        changed (file touched or checked out again) the state is refreshed and
+        None is returned as well.
+        """
+        page_state = self.page_state.get(title, {})
+        with self.metrics.phase('read'):
+            fingerprint = self.get_fingerprint(file_path)
+            if not force and page_state.get('fingerprint') == fingerprint:
+                self.metrics.count_page('unchanged')
+                return None
+            with open(file_path, 'rb') as f:
+                data = f.read()
+            current_hash = self.hash_bytes(data)
+            if not force and page_state.get('hash') == current_hash:
+                self.page_state[title] = {**page_state, 'fingerprint': fingerprint}
+                self.state_changed = True
+                self.metrics.count_page('unchanged')
+                return None
+            # Same newline handling as reading in text mode
+            content = data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+            return LocalFile(fingerprint, content, current_hash)
     
     def get_page_title_from_filename(self, filename: str) -> str:
         """Convert filename to MediaWiki page title"""
         # Remove .mediawiki extension
         title = filename.replace('.mediawiki', '')
+        # Template_Name.mediawiki is Template:Name, as in import-templates.sh
+        if title.startswith(TEMPLATE_FILE_PREFIX):
+            title = 'Template:' + title[len(TEMPLATE_FILE_PREFIX):]
         # Replace underscores with spaces
         title = title.replace('_', ' ')
         return title
     
-    def update_page(self, title: str, content: str, summary: str = "Updated via sync script") -> bool:
-        """Update or create a MediaWiki page"""
+    def normalize_title(self, title: str) -> str:
+        title = ' '.join(title.replace('_', ' ').split())
+        return title[:1].upper() + title[1:]
+    
+    def parse_transclusions(self, content: str) -> List[str]:
+        """Titles of the pages and templates transcluded by ``content``
+        
+        {{Name}} refers to Template:Name and {{:Name}} to the page Name. Parser
+        functions, parameters and anything inside nowiki/pre/code/noinclude are ignored.
+        """
+        titles = set()
+        for name in TRANSCLUSION.findall(NON_TRANSCLUDED.sub('', content)):
+            for prefix in ('subst:', 'safesubst:'):
+                if name.lower().startswith(prefix):
+                    name = name[len(prefix):]
+            if name.startswith(':'):
+                title = self.normalize_title(name[1:])
+            elif name.lower().startswith('template:'):
+                title = 'Template:' + self.normalize_title(name[len('template:'):])
+            elif ':' in name:
+                continue  # Magic words and other namespaces
+            else:
+                title = 'Template:' + self.normalize_title(name)
+            titles.add(title)
+        return sorted(titles)
+    
+    def get_dependents(self, titles: List[str]) -> List[str]:
+        """All pages that transclude any of ``titles``, directly or through other templates"""
+        transcluded_by: Dict[str, List[str]] = {}
+        for page, state in self.page_state.items():
+            for template in state.get('templates', []):
+                transcluded_by.setdefault(template, []).append(page)
+        dependents = set()
+        pending = list(titles)
+        while pending:
+            for page in transcluded_by.get(pending.pop(), []):
+                if page not in dependents:
+                    dependents.add(page)
+                    pending.append(page)
+        return sorted(dependents - set(titles))
+    
+    def dependency_levels(self, dependencies: Dict[str, List[str]]) -> List[List[str]]:
+        """Group titles so each one comes after the titles it transcludes
+        
+        Only dependencies between the given titles count. A cycle is broken
+        where it is found, with a warning.
+        """
+        levels: Dict[str, int] = {}
+        visiting = set()
+        
+        def level_of(title: str) -> int:
+            if title in levels:
+                return levels[title]
+            visiting.add(title)
+            level = 0
+            for dependency in dependencies[title]:
+                if dependency not in dependencies or dependency == title:
+                    continue
+                if dependency in visiting:
+                    print(f"⚠️  Template loop between {title} and {dependency}, ignoring it for ordering")
+                    continue
+                level = max(level, level_of(dependency) + 1)
+            visiting.discard(title)
+            levels[title] = level
+            return level
+        
+        for title in sorted(dependencies):
+            level_of(title)
+        grouped: List[List[str]] = [[] for _ in range(max(levels.values(), default=-1) + 1)]
+        for title in sorted(levels):
+            grouped[levels[title]].append(title)
+        return grouped
+    
+    def purge_pages(self, titles: List[str]):
+        """Purge pages in batches so they are re-rendered with their current templates"""
+        with self.metrics.phase('purge'):
+            self._purge_batches(titles)
+    
+    def _purge_batches(self, titles: List[str]):
+        for start in range(0, len(titles), QUERY_BATCH_SIZE):
+            batch = titles[start:start + QUERY_BATCH_SIZE]
+            response = self.post_api({
+                'action': 'purge',
+                'titles': '|'.join(batch),
+                'forcelinkupdate': 1,
+                'format': 'json'
+            })
+            if response.status_code != 200 or 'error' in response.json():
+                print(f"⚠️  Failed to purge {len(batch)} pages")
+    
+    def get_content_sha1(self, content: str) -> str:
+        """SHA1 of the text as MediaWiki stores it (LF line endings, trailing whitespace trimmed)"""
+        normalized = content.replace('\r\n', '\n').rstrip()
+        return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+    
+    def get_remote_revisions(self, titles: List[str]) -> Dict[str, Optional[dict]]:
+        """Fetch sha1, revision id and timestamp of the current revision of each title.
+        
+        Titles are queried in batches of QUERY_BATCH_SIZE. Missing pages map to None.
+        """
+        revisions = {}
+        for start in range(0, len(titles), QUERY_BATCH_SIZE):
+            batch = titles[start:start + QUERY_BATCH_SIZE]
+            response = self.post_api({
+                'action': 'query',
+                'prop': 'revisions',
+                'rvprop': 'ids|timestamp|sha1',
+                'titles': '|'.join(batch),
+                'format': 'json'
+            })
+            if response.status_code != 200:
+                print(f"⚠️  Could not fetch current revisions: {response.status_code}")
+                continue
+            data = response.json()
+            if 'error' in data:
+                print(f"⚠️  Could not fetch current revisions: {data['error']['info']}")
+                continue
+            query = data.get('query', {})
+            # The API reports titles in normalized form, so map them back to ours
+            original = {entry['to']: entry['from'] for entry in query.get('normalized', [])}
+            for page in query.get('pages', {}).values():
+                title = original.get(page['title'], page['title'])
+                if 'missing' in page or not page.get('revisions'):
+                    revisions[title] = None
+                else:
+                    revisions[title] = page['revisions'][0]
+        return revisions
+    
+    def update_page(self, title: str, content: str, summary: str = "Updated via sync script",
+                    base: Optional[dict] = None) -> Optional[dict]:
+        """Update or create a MediaWiki page, returning the edit result on success
+        
+        ``base`` is the last known revision (revid and timestamp) of the page. It
+        is sent as baserevid/basetimestamp so the server does not need to look
+        for edit conflicts; if the page was changed on the wiki since then, the
+        edit is repeated without it and overwrites the page as before.
+        """
         print(f"📝 Updating page: {title}")
         
-        response = self.session.post(self.api_url, data={
+        # assert=user makes an expired session fail instead of editing anonymously
+        params = {
             'action': 'edit',
             'title': title,
             'text': content,
             'summary': summary,
-            'token': self.csrf_token,
+            'assert': 'user',
             'format': 'json'
-        })
-        
-        if response.status_code != 200:
-            print(f"❌ Failed to update {title}: {response.status_code}")
-            return False
+        }
+        if base and base.get('revid') and base.get('timestamp'):
+            params['baserevid'] = base['revid']
+            params['basetimestamp'] = base['timestamp']
+        multipart = len(content.encode('utf-8')) >= MULTIPART_MIN_BYTES
+        session_renewed = False
+        while True:
+            generation = self.session_generation
+            response = self.post_api({**params, 'token': self.csrf_token}, multipart)
             
-        data = response.json()
+            if response.status_code != 200:
+                print(f"❌ Failed to update {title}: {response.status_code}")
+                return None
+                
+            data = response.json()
+            error = data.get('error', {}).get('code')
+            if error in TOKEN_ERRORS + SESSION_ERRORS and not session_renewed:
+                session_renewed = True
+                if self.renew_session(error, generation):
+                    continue
+            elif error == 'editconflict' and 'baserevid' in params:
+                print(f"⚠️  {title} was changed on the wiki since the last sync, overwriting it")
+                del params['baserevid'], params['basetimestamp']
+                continue
+            break
+        
         if 'error' in data:
             print(f"❌ Error updating {title}: {data['error']['info']}")
-            return False
+            return None
             
         if 'edit' in data and data['edit']['result'] == 'Success':
             print(f"✅ Successfully updated: {title}")
-            return True
+            return data['edit']
         else:
             print(f"❌ Unknown error updating {title}: {data}")
-            return False
+            return None
     
-    def sync_file(self, file_path: str, force: bool = False) -> bool:
-        """Sync a single file to MediaWiki"""
+    def sync_file(self, file_path: str, force: bool = False, remote: Optional[dict] = None,
+                  local: Optional[LocalFile] = None) -> bool:
+        """Sync a single file to MediaWiki
+        
+        ``remote`` is the page's current revision from get_remote_revisions(); when
+        its sha1 already matches the file, no edit is sent. ``local`` is the file
+        as already read by read_if_changed().
+        """
         if not os.path.exists(file_path):
             print(f"❌ File not found: {file_path}")
             return False
         
-        # Check if file has changed (unless force sync)
-        current_hash = self.get_file_hash(file_path)
-        if not force and file_path in self.content_hashes:
-            if self.content_hashes[file_path] == current_hash:
-                return True  # No changes, skip
-        
-        # Read content
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
         # Get page title
         filename = os.path.basename(file_path)
         title = self.get_page_title_from_filename(filename)
+        page_state = self.page_state.get(title, {})
+        
+        # Check if file has changed since the last sync (unless force sync)
+        if local is None:
+            local = self.read_if_changed(file_path, title, force)
+            if local is None:
+                return True  # No changes, skip
+        
+        # The wiki already has this text (imported, or synced by a run whose state was lost)
+        templates = self.parse_transclusions(local.content)
+        content_sha1 = self.get_content_sha1(local.content)
+        if not force and remote and remote.get('sha1') == content_sha1:
+            self.page_state[title] = {
+                'hash': local.hash,
+                'fingerprint': local.fingerprint,
+                'templates': templates,
+                'sha1': content_sha1,
+                'revid': remote.get('revid'),
+                'timestamp': remote.get('timestamp'),
+            }
+            self.state_changed = True
+            self.metrics.count_page('remote_match')
+            return True
+        
+        # Only line endings or trailing whitespace changed since the last sync: the
+        # wiki would store the same text, so don't send a no-op edit
+        if (not force and page_state.get('sha1') == content_sha1
+                and (remote is None or remote.get('revid') == page_state.get('revid'))):
+            self.page_state[title] = {**page_state, 'hash': local.hash, 'fingerprint': local.fingerprint}
+            self.state_changed = True
+            self.metrics.count_page('unchanged')
+            return True
         
         # Update page
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         summary = f"Synced from {filename} at {timestamp}"
         
-        if self.update_page(title, content, summary):
-            self.content_hashes[file_path] = current_hash
-            return True
-        else:
+        # The preflight revision is the freshest; fall back to the one from the last sync
+        base = remote if remote and remote.get('revid') else page_state
+        with self.metrics.phase('edit'):
+            edit = self.update_page(title, local.content, summary, base)
+        if edit is None:
+            self.metrics.count_page('failed')
             return False
+        self.metrics.count_page('nochange' if 'nochange' in edit else 'edited')
+        if 'nochange' not in edit:
+            self.edited_titles.add(title)
+        # A no-op edit has no new revision, so keep the previous one
+        self.page_state[title] = {
+            'hash': local.hash,
+            'fingerprint': local.fingerprint,
+            'templates': templates,
+            'sha1': content_sha1,
+            'revid': edit.get('newrevid', page_state.get('revid')),
+            'timestamp': edit.get('newtimestamp', page_state.get('timestamp')),
+        }
+        self.state_changed = True
+        return True
     
     def sync_directory(self, content_dir: str, force: bool = False) -> Dict[str, bool]:
-        """Sync all .mediawiki files in a directory"""
+        """Sync all .mediawiki files in a directory, and the templates directory if set"""
         results = {}
         content_path = Path(content_dir)
         
@@ -172,26 +754,200 @@ class MediaWikiSync:
         
         # Find all .mediawiki files
         mediawiki_files = list(content_path.glob("**/*.mediawiki"))
+        if self.templates_dir and os.path.isdir(self.templates_dir):
+            print(f"🧩 Syncing templates from: {self.templates_dir}")
+            mediawiki_files += list(Path(self.templates_dir).glob("**/*.mediawiki"))
         
         if not mediawiki_files:
             print("⚠️  No .mediawiki files found in content directory")
             return results
         
         print(f"📄 Found {len(mediawiki_files)} files to sync")
+        return self.sync_paths(mediawiki_files, force)
+    
+    def sync_paths(self, mediawiki_files: List[Path], force: bool = False) -> Dict[str, bool]:
+        """Sync the given .mediawiki files and save the sync state"""
+        results = {}
         
-        # Sync each file
+        # Two files for the same page would overwrite each other, so sync neither
+        files_for_title = {}
         for file_path in mediawiki_files:
-            file_str = str(file_path)
+            file_strs = files_for_title.setdefault(self.get_page_title_from_filename(file_path.name), [])
+            if str(file_path) not in file_strs:
+                file_strs.append(str(file_path))
+        for title, file_strs in files_for_title.items():
+            if len(file_strs) > 1:
+                print(f"❌ {len(file_strs)} files map to the page {title}: {', '.join(file_strs)}")
+                for file_str in file_strs:
+                    self.metrics.count_page('failed')
+                    results[file_str] = False
+        
+        # Only files whose fingerprint and hash differ from the sync state are read and synced
+        changed = {}
+        for title, file_strs in files_for_title.items():
+            if len(file_strs) > 1:
+                continue
+            file_str = file_strs[0]
             try:
-                results[file_str] = self.sync_file(file_str, force)
-            except Exception as e:
-                print(f"❌ Error syncing {file_str}: {e}")
+                local = self.read_if_changed(file_str, title, force)
+            except (OSError, UnicodeDecodeError) as e:
+                print(f"❌ Error reading {file_str}: {e}")
+                self.metrics.count_page('failed')
                 results[file_str] = False
+                continue
+            if local is None:
+                results[file_str] = True
+            else:
+                changed[file_str] = (title, local)
+        
+        # Ask the wiki for the current revisions of pages the local state can't rule out
+        remote = {}
+        if self.remote_diff and not force and changed:
+            print(f"🔎 Checking {len(changed)} pages against the wiki")
+            with self.metrics.phase('preflight'):
+                remote = self.get_remote_revisions([title for title, _ in changed.values()])
+        
+        # Templates go first: each level only transcludes titles from earlier levels
+        dependencies = {title: self.parse_transclusions(local.content) for title, local in changed.values()}
+        files_by_title = {title: (file_str, local) for file_str, (title, local) in changed.items()}
+        self.edited_titles = set()
+        
+        # Sync files in parallel, bounded by the number of workers
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for level in self.dependency_levels(dependencies):
+                futures = {}
+                for title in level:
+                    file_str, local = files_by_title[title]
+                    futures[executor.submit(self.sync_file, file_str, force, remote.get(title), local)] = file_str
+                for future in as_completed(futures):
+                    file_str = futures[future]
+                    try:
+                        results[file_str] = future.result()
+                    except Exception as e:
+                        print(f"❌ Error syncing {file_str}: {e}")
+                        self.metrics.count_page('failed')
+                        results[file_str] = False
+        
+        # Re-render only the pages that use a template that was actually edited
+        edited = [title for title in files_by_title if title in self.edited_titles]
+        edited_templates = [title for title in edited if title.startswith('Template:')]
+        if edited_templates:
+            dependents = [title for title in self.get_dependents(edited_templates) if title not in edited]
+            for template in edited_templates:
+                print(f"🧩 {template} changed, affects: {', '.join(self.get_dependents([template])) or 'no pages'}")
+            if dependents and self.purge:
+                print(f"🧹 Purging {len(dependents)} dependent pages")
+                self.purge_pages(dependents)
         
+        self.save_state()
         return results
     
-    def watch_directory(self, content_dir: str, interval: int = 5):
-        """Watch directory for changes and sync automatically"""
+    def export_xml(self, content_dir: str, output_path: str) -> int:
+        """Write all pages and templates as one MediaWiki XML dump for importDump.php
+        
+        Files are streamed one at a time, templates first, into a temporary file
+        that replaces ``output_path`` once complete. Returns the number of pages.
+        """
+        content_path = Path(content_dir)
+        if not content_path.exists():
+            print(f"❌ Content directory not found: {content_dir}")
+            return 0
+        
+        templates = []
+        if self.templates_dir and os.path.isdir(self.templates_dir):
+            templates = sorted(Path(self.templates_dir).glob("**/*.mediawiki"))
+        pages = sorted(content_path.glob("**/*.mediawiki"))
+        
+        output_dir = os.path.dirname(os.path.abspath(output_path))
+        fd, tmp_path = tempfile.mkstemp(dir=output_dir, prefix='.export.', suffix='.tmp')
+        contributor = escape(self.username or 'Sync script')
+        count = 0
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8', newline='\n') as out:
+                out.write(f'<mediawiki xmlns="{EXPORT_NAMESPACE}" version="0.11" xml:lang="en">\n')
+                out.write('  <siteinfo>\n    <namespaces>\n')
+                out.write('      <namespace key="0" case="first-letter" />\n')
+                out.write(f'      <namespace key="{TEMPLATE_NAMESPACE_ID}" case="first-letter">Template</namespace>\n')
+                out.write('    </namespaces>\n  </siteinfo>\n')
+                for file_path in templates + pages:
+                    title = self.get_page_title_from_filename(file_path.name)
+                    with open(file_path, 'r', encoding='utf-8') as f:
+                        content = f.read()
+                    modified = datetime.fromtimestamp(file_path.stat().st_mtime, timezone.utc)
+                    namespace = TEMPLATE_NAMESPACE_ID if title.startswith('Template:') else 0
+                    out.write('  <page>\n')
+                    out.write(f'    <title>{escape(title)}</title>\n')
+                    out.write(f'    <ns>{namespace}</ns>\n')
+                    out.write('    <revision>\n')
+                    out.write(f'      <timestamp>{modified.strftime("%Y-%m-%dT%H:%M:%SZ")}</timestamp>\n')
+                    out.write(f'      <contributor><username>{contributor}</username></contributor>\n')
+                    out.write(f'      <comment>{escape(f"Imported from {file_path.name}")}</comment>\n')
+                    out.write('      <model>wikitext</model>\n')
+                    out.write('      <format>text/x-wiki</format>\n')
+                    out.write(f'      <text bytes="{len(content.encode("utf-8"))}" xml:space="preserve">')
+                    out.write(escape(content))
+                    out.write('</text>\n')
+                    out.write('    </revision>\n')
+                    out.write('  </page>\n')
+                    count += 1
+                out.write('</mediawiki>\n')
+            os.replace(tmp_path, output_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        
+        print(f"📦 Exported {count} pages ({len(templates)} templates) to {output_path}")
+        return count
+    
+    def watch_directory(self, content_dir: str, interval: int = 5, mode: str = 'auto', debounce: float = 0.2):
+        """Watch directory for changes and sync automatically
+        
+        Uses inotify on Linux so only changed files are synced, shortly after they
+        are saved. Falls back to polling every ``interval`` seconds elsewhere.
+        """
+        watcher = None
+        if mode in ('auto', 'inotify'):
+            try:
+                watch_dirs = [content_dir]
+                if self.templates_dir and os.path.isdir(self.templates_dir):
+                    watch_dirs.append(self.templates_dir)
+                watcher = InotifyWatcher(*watch_dirs)
+            except OSError as e:
+                if mode == 'inotify':
+                    print(f"❌ inotify is not available: {e}")
+                    return
+                print(f"⚠️  inotify is not available ({e}), falling back to polling")
+        
+        if watcher is None:
+            self.poll_directory(content_dir, interval)
+            return
+        
+        print(f"👀 Watching {content_dir} for changes (inotify)")
+        print("Press Ctrl+C to stop watching...")
+        try:
+            # Catch up on anything changed while we were not watching
+            self.sync_directory(content_dir)
+            while True:
+                changed = watcher.wait_for_changes(debounce)
+                if watcher.overflowed:
+                    # Events were lost, so nothing tells us what changed: compare everything
+                    print("⚠️  Too many changes at once for inotify, rescanning all files")
+                    watcher.overflowed = False
+                    self.sync_directory(content_dir)
+                    continue
+                existing = [Path(path) for path in sorted(changed) if os.path.isfile(path)]
+                if not existing:
+                    continue
+                results = self.sync_paths(existing)
+                synced = sum(1 for success in results.values() if success)
+                print(f"🔄 Synced {synced} of {len(existing)} changed files at {datetime.now().strftime('%H:%M:%S')}")
+        except KeyboardInterrupt:
+            print("\n⏹️  Stopped watching for changes")
+        finally:
+            watcher.close()
+    
+    def poll_directory(self, content_dir: str, interval: int = 5):
+        """Re-scan the directory every ``interval`` seconds and sync what changed"""
         print(f"👀 Watching {content_dir} for changes (checking every {interval}s)")
         print("Press Ctrl+C to stop watching...")
         
@@ -208,24 +964,161 @@ class MediaWikiSync:
         except KeyboardInterrupt:
             print("\n⏹️  Stopped watching for changes")
 
+
+class InotifyWatcher:
+    """Minimal Linux inotify wrapper reporting changed .mediawiki files under a directory"""
+    
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+    IN_ISDIR = 0x40000000
+    IN_CLOEXEC = 0o2000000
+    EVENT_HEADER = struct.Struct('iIII')
+    
+    def __init__(self, *directories: str):
+        if not sys.platform.startswith('linux'):
+            raise OSError(f"inotify requires Linux, not {sys.platform}")
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        self.watches: Dict[int, str] = {}
+        self.directories = directories
+        # Set when the kernel dropped events; the caller should rescan everything
+        self.overflowed = False
+        for content_dir in directories:
+            for directory, _, _ in os.walk(content_dir):
+                self.add_watch(directory)
+    
+    def add_watch(self, directory: str):
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch {directory}: {os.strerror(ctypes.get_errno())}")
+        self.watches[wd] = directory
+    
+    def watch_tree(self, top: str) -> List[str]:
+        """Watch ``top`` and its subdirectories; return the .mediawiki files already in them
+        
+        Files written before the watch existed produce no events of their own.
+        """
+        found = []
+        for directory, _, files in os.walk(top):
+            try:
+                self.add_watch(directory)
+            except OSError as e:
+                print(f"⚠️  Not watching {directory}: {e}")
+                continue
+            found += [os.path.join(directory, f) for f in files if f.endswith('.mediawiki')]
+        return found
+    
+    def read_events(self, timeout: Optional[float]) -> List[str]:
+        """Return the .mediawiki paths changed by the next batch of events ([] on timeout)
+        
+        On a queue overflow ``overflowed`` is set and every directory is watched
+        again, since directories created meanwhile may have been missed.
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        buffer = os.read(self.fd, 64 * 1024)
+        changed = []
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, length = self.EVENT_HEADER.unpack_from(buffer, offset)
+            offset += self.EVENT_HEADER.size
+            name = os.fsdecode(buffer[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & self.IN_Q_OVERFLOW:
+                self.overflowed = True
+                for content_dir in self.directories:
+                    self.watch_tree(content_dir)
+                continue
+            path = os.path.join(self.watches.get(wd, ''), name)
+            if mask & self.IN_ISDIR:
+                # Watch new or moved-in subdirectories and sync what they already contain
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    changed += self.watch_tree(path)
+            elif name.endswith('.mediawiki') and not mask & self.IN_CREATE:
+                changed.append(path)
+        return changed
+    
+    def wait_for_changes(self, debounce: float) -> set:
+        """Block until files change, then collect events until none arrive for ``debounce`` seconds"""
+        changed = set()
+        while not changed and not self.overflowed:
+            changed.update(self.read_events(None))
+        while True:
+            more = self.read_events(debounce)
+            if not more:
+                return changed
+            changed.update(more)
+    
+    def close(self):
+        os.close(self.fd)
+
 def main():
     parser = argparse.ArgumentParser(description='Sync MediaWiki content from local files')
-    parser.add_argument('--url', required=True, help='MediaWiki URL (e.g., http://localhost:8080)')
-    parser.add_argument('--username', required=True, help='MediaWiki username')
-    parser.add_argument('--password', required=True, help='MediaWiki password')
+    parser.add_argument('--url', help='MediaWiki URL (e.g., http://localhost:8080)')
+    parser.add_argument('--username', help='MediaWiki username')
+    parser.add_argument('--password', help='MediaWiki password')
     parser.add_argument('--content-dir', default='internal-wiki/content', help='Content directory path')
+    parser.add_argument('--templates-dir', default='internal-wiki/templates',
+                        help='Template directory path, synced before the pages that use it (empty to skip)')
+    parser.add_argument('--no-purge', action='store_true',
+                        help='Do not purge pages that use a changed template')
     parser.add_argument('--watch', action='store_true', help='Watch for changes and auto-sync')
-    parser.add_argument('--interval', type=int, default=5, help='Watch interval in seconds')
+    parser.add_argument('--interval', type=int, default=5, help='Watch interval in seconds (polling mode)')
+    parser.add_argument('--watch-mode', choices=['auto', 'inotify', 'poll'], default='auto',
+                        help='How to detect changes: inotify on Linux, polling elsewhere (default: auto)')
+    parser.add_argument('--debounce', type=float, default=0.2,
+                        help='Seconds to wait for further saves before syncing (inotify mode)')
     parser.add_argument('--force', action='store_true', help='Force sync all files regardless of changes')
     parser.add_argument('--file', help='Sync a specific file instead of entire directory')
+    parser.add_argument('--workers', type=int, default=4, help='Number of pages to upload in parallel')
+    parser.add_argument('--maxlag', type=int, default=5, help='MediaWiki maxlag in seconds (0 to disable)')
+    parser.add_argument('--state-file', default='.sync-state.json',
+                        help='File that remembers what was synced between runs')
+    parser.add_argument('--no-state', action='store_true', help='Do not read or write the sync state file')
+    parser.add_argument('--session-file', default='.sync-session.json',
+                        help='Cache login cookies here so later runs can skip the login handshake')
+    parser.add_argument('--no-session-cache', action='store_true', help='Always log in and do not cache cookies')
+    parser.add_argument('--gzip-requests', action='store_true',
+                        help='Gzip large request bodies (only if the web server decompresses them)')
+    parser.add_argument('--no-remote-diff', action='store_true',
+                        help='Do not compare pages with the wiki before editing them')
+    parser.add_argument('--export-xml', metavar='FILE',
+                        help='Write pages and templates as an XML dump for importDump.php instead of syncing')
+    parser.add_argument('--metrics-json', metavar='FILE',
+                        help="Write timings, request latencies and page counts as JSON ('-' for stdout)")
+    parser.add_argument('--metrics-prom', metavar='FILE',
+                        help="Write the same metrics in Prometheus text format ('-' for stdout)")
     
     args = parser.parse_args()
+    if not args.export_xml and not (args.url and args.username and args.password):
+        parser.error('--url, --username and --password are required unless --export-xml is used')
+    
+    if args.export_xml:
+        # Offline: no wiki connection or sync state needed
+        exporter = MediaWikiSync(args.url or '', args.username or '', '', templates_dir=args.templates_dir or None)
+        if not exporter.export_xml(args.content_dir, args.export_xml):
+            sys.exit(1)
+        return
     
     # Create sync instance
-    sync = MediaWikiSync(args.url, args.username, args.password)
+    sync = MediaWikiSync(args.url, args.username, args.password, workers=args.workers, maxlag=args.maxlag,
+                         state_file=None if args.no_state else args.state_file,
+                         remote_diff=not args.no_remote_diff,
+                         templates_dir=args.templates_dir or None, purge=not args.no_purge,
+                         session_file=None if args.no_session_cache else args.session_file,
+                         gzip_requests=args.gzip_requests)
     
     # Login
-    if not sync.login():
+    with sync.metrics.phase('login'):
+        logged_in = sync.login()
+    if not logged_in:
+        sync.metrics.write(args.metrics_json, args.metrics_prom)
         sys.exit(1)
     
     try:
@@ -233,6 +1126,7 @@ def main():
             # Sync specific file
             print(f"📄 Syncing single file: {args.file}")
             success = sync.sync_file(args.file, args.force)
+            sync.save_state()
             if success:
                 print("✅ File sync completed successfully")
             else:
@@ -241,7 +1135,7 @@ def main():
                 
         elif args.watch:
             # Watch mode
-            sync.watch_directory(args.content_dir, args.interval)
+            sync.watch_directory(args.content_dir, args.interval, args.watch_mode, args.debounce)
             
         else:
             # One-time sync
@@ -269,6 +1163,8 @@ def main():
     except Exception as e:
         print(f"❌ Unexpected error: {e}")
         sys.exit(1)
+    finally:
+        sync.metrics.write(args.metrics_json, args.metrics_prom)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""Tests for sync-content.py, with the wiki replaced by in-memory stubs or a local HTTP stand-in."""
+import email.parser
+import gzip
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs
+
+spec = importlib.util.spec_from_file_location(
+    "sync_content", os.path.join(os.path.dirname(os.path.abspath(__file__)), "sync-content.py")
+)
+sync_content = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(sync_content)
+
+
+class FakeWikiSync(sync_content.MediaWikiSync):
+    """Keeps pages in memory instead of calling the API."""
+
+    def __init__(self, pages, **kwargs):
+        super().__init__("http://wiki.invalid", "user", "secret", workers=2, **kwargs)
+        self.pages = pages  # title -> (text, revid)
+        self.edits = []
+        self.purged = []
+
+    def get_remote_revisions(self, titles):
+        return {
+            title: {
+                "revid": self.pages[title][1],
+                "timestamp": "2024-01-01T00:00:00Z",
+                "sha1": self.get_content_sha1(self.pages[title][0]),
+            } if title in self.pages else None
+            for title in titles
+        }
+
+    def update_page(self, title, content, summary="", base=None):
+        self.edits.append((title, (base or {}).get("revid")))
+        revid = max(revid for _, revid in self.pages.values()) + 1 if self.pages else 1
+        self.pages[title] = (content, revid)
+        return {"result": "Success", "newrevid": revid, "newtimestamp": "2024-01-02T00:00:00Z"}
+
+    def purge_pages(self, titles):
+        self.purged.extend(titles)
+
+
+class SyncPathsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.dir = Path(self.tmp.name)
+
+    def write(self, name, text):
+        path = self.dir / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text, encoding="utf-8")
+        return path
+
+    def test_each_page_gets_its_own_preflight_revision(self):
+        files = [
+            self.write("Alpha.mediawiki", "new alpha"),
+            self.write("Beta.mediawiki", "new beta {{Info}}"),
+            self.write("Template_Info.mediawiki", "new info"),
+        ]
+        pages = {"Alpha": ("old alpha", 11), "Beta": ("old beta", 12), "Template:Info": ("old info", 13)}
+        sync = FakeWikiSync(pages)
+
+        results = sync.sync_paths(files)
+
+        self.assertTrue(all(results.values()))
+        self.assertEqual(sorted(sync.edits), [("Alpha", 11), ("Beta", 12), ("Template:Info", 13)])
+
+    def test_pages_already_on_the_wiki_are_not_edited_or_purged(self):
+        files = [
+            self.write("Alpha.mediawiki", "alpha {{Info}}"),
+            self.write("Beta.mediawiki", "beta"),
+            self.write("Template_Info.mediawiki", "info"),
+        ]
+        pages = {"Alpha": ("alpha {{Info}}", 21), "Beta": ("beta\n", 22), "Template:Info": ("info", 23)}
+        sync = FakeWikiSync(pages)
+
+        results = sync.sync_paths(files)
+
+        self.assertTrue(all(results.values()))
+        self.assertEqual(sync.edits, [])
+        self.assertEqual(sync.purged, [])
+        self.assertEqual(sync.page_state["Beta"]["revid"], 22)
+
+    def test_state_from_an_older_version_does_not_cause_uploads(self):
+        files = [self.write("Alpha.mediawiki", "alpha"), self.write("Beta.mediawiki", "beta")]
+        state_file = self.dir / "state.json"
+        state_file.write_text(
+            '{"version": 2, "wiki_url": "http://wiki.invalid", "pages": {"Alpha": {"hash": "stale"}}}',
+            encoding="utf-8",
+        )
+        sync = FakeWikiSync({"Alpha": ("alpha", 41), "Beta": ("beta", 42)}, state_file=str(state_file))
+
+        results = sync.sync_paths(files)
+
+        self.assertTrue(all(results.values()))
+        self.assertEqual(sync.edits, [])
+        reloaded = FakeWikiSync({}, state_file=str(state_file))
+        self.assertEqual(reloaded.page_state["Alpha"]["revid"], 41)
+        self.assertEqual(reloaded.page_state["Beta"]["revid"], 42)
+
+    def test_dependents_of_an_edited_template_are_purged(self):
+        files = [
+            self.write("Alpha.mediawiki", "alpha {{Info}}"),
+            self.write("Template_Info.mediawiki", "new info"),
+        ]
+        pages = {"Alpha": ("alpha {{Info}}", 31), "Template:Info": ("old info", 32)}
+        sync = FakeWikiSync(pages)
+
+        sync.sync_paths(files)
+
+        self.assertEqual(sync.edits, [("Template:Info", 32)])
+        self.assertEqual(sync.purged, ["Alpha"])
+
+    def test_files_for_the_same_title_are_reported(self):
+        files = [
+            self.write("Alpha.mediawiki", "one"),
+            self.write("nested/Alpha.mediawiki", "two"),
+            self.write("Beta.mediawiki", "beta"),
+        ]
+        sync = FakeWikiSync({})
+
+        results = sync.sync_paths(files)
+
+        self.assertFalse(results[str(files[0])])
+        self.assertFalse(results[str(files[1])])
+        self.assertTrue(results[str(files[2])])
+        self.assertEqual(sync.edits, [("Beta", None)])
+
+
+class StandInApi(BaseHTTPRequestHandler):
+    """api.php stand-in: logs every request and answers edits from a script of canned replies."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, body, status=200, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def read_fields(self):
+        raw = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.headers.get("Content-Encoding") == "gzip":
+            raw = gzip.decompress(raw)
+        content_type = self.headers.get("Content-Type", "")
+        if content_type.startswith("multipart/form-data"):
+            message = email.parser.BytesParser().parsebytes(
+                b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + raw
+            )
+            return {
+                part.get_param("name", header="content-disposition"): part.get_payload(decode=True).decode()
+                for part in message.get_payload()
+            }
+        return {name: values[0] for name, values in parse_qs(raw.decode(), keep_blank_values=True).items()}
+
+    def do_POST(self):
+        server = self.server
+        fields = self.read_fields()
+        server.requests.append({
+            "fields": fields,
+            "content_type": self.headers.get("Content-Type", ""),
+            "content_encoding": self.headers.get("Content-Encoding"),
+            "client_port": self.client_address[1],
+        })
+        action = fields.get("action")
+        if action == "query" and fields.get("meta") == "tokens":
+            if fields.get("type") == "login":
+                return self.reply({"query": {"tokens": {"logintoken": "login+\\"}}})
+            return self.reply({"query": {"tokens": {"csrftoken": server.csrf_token}}})
+        if action == "login":
+            return self.reply({"login": {"result": "Success"}}, headers={"Set-Cookie": "wikisession=ok; Path=/"})
+        if action == "edit":
+            if server.edit_replies:
+                status, body, headers = server.edit_replies.pop(0)
+                return self.reply(body, status, headers)
+            server.revid += 1
+            return self.reply({"edit": {"result": "Success", "newrevid": server.revid,
+                                        "newtimestamp": "2024-01-02T00:00:00Z"}})
+        self.reply({"error": {"code": "unknown", "info": action}})
+
+
+class HttpApiTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StandInApi)
+        self.server.requests = []
+        self.server.edit_replies = []
+        self.server.csrf_token = "token-1+\\"
+        self.server.revid = 100
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.sync = sync_content.MediaWikiSync(
+            f"http://127.0.0.1:{self.server.server_port}", "user", "secret", workers=1, max_retries=3
+        )
+        self.sync.csrf_token = self.server.csrf_token
+
+    def edits(self):
+        return [request for request in self.server.requests if request["fields"].get("action") == "edit"]
+
+    def test_busy_server_is_retried_after_retry_after(self):
+        self.server.edit_replies = [
+            (503, {}, {"Retry-After": "0"}),
+            (429, {}, {"Retry-After": "0"}),
+            (200, {"error": {"code": "maxlag", "info": "lagged"}}, {"Retry-After": "0"}),
+        ]
+
+        edit = self.sync.update_page("Alpha", "text")
+
+        self.assertEqual(edit["newrevid"], 101)
+        self.assertEqual(len(self.edits()), 4)
+        self.assertEqual(self.sync.metrics.retries, 3)
+        self.assertTrue(all(request["fields"]["maxlag"] == "5" for request in self.edits()))
+
+    def test_requests_reuse_one_connection(self):
+        for title in ("Alpha", "Beta", "Gamma"):
+            self.sync.update_page(title, "text")
+
+        self.assertEqual(len({request["client_port"] for request in self.server.requests}), 1)
+
+    def test_bad_token_gets_a_new_token_and_retries(self):
+        self.server.edit_replies = [(200, {"error": {"code": "badtoken", "info": "Invalid CSRF token."}}, {})]
+        self.server.csrf_token = "token-2+\\"
+
+        self.assertIsNotNone(self.sync.update_page("Alpha", "text"))
+
+        actions = [request["fields"]["action"] for request in self.server.requests]
+        self.assertEqual(actions, ["edit", "query", "edit"])
+        self.assertEqual(self.edits()[-1]["fields"]["token"], "token-2+\\")
+
+    def test_expired_session_logs_in_again(self):
+        self.server.edit_replies = [(200, {"error": {"code": "assertuserfailed", "info": "not logged in"}}, {})]
+
+        self.assertIsNotNone(self.sync.update_page("Alpha", "text"))
+
+        actions = [request["fields"]["action"] for request in self.server.requests]
+        self.assertEqual(actions, ["edit", "query", "login", "query", "edit"])
+        self.assertEqual(self.edits()[0]["fields"]["assert"], "user")
+
+    def test_large_pages_are_sent_as_multipart_and_gzip(self):
+        self.sync.gzip_requests = True
+        content = "== Section ==\n" + "Text with & and = signs. " * 400
+
+        self.sync.update_page("Alpha", content)
+        self.sync.update_page("Beta", "short")
+
+        large, small = self.edits()
+        self.assertTrue(large["content_type"].startswith("multipart/form-data"))
+        self.assertEqual(large["content_encoding"], "gzip")
+        self.assertEqual(large["fields"]["text"], content)
+        self.assertEqual(small["content_type"], "application/x-www-form-urlencoded")
+        self.assertIsNone(small["content_encoding"])
+
+    def test_edit_conflict_on_base_revision_is_retried_without_it(self):
+        self.server.edit_replies = [(200, {"error": {"code": "editconflict", "info": "Edit conflict."}}, {})]
+
+        edit = self.sync.update_page("Alpha", "text", base={"revid": 7, "timestamp": "2024-01-01T00:00:00Z"})
+
+        self.assertIsNotNone(edit)
+        first, second = self.edits()
+        self.assertEqual(first["fields"]["baserevid"], "7")
+        self.assertEqual(first["fields"]["basetimestamp"], "2024-01-01T00:00:00Z")
+        self.assertNotIn("baserevid", second["fields"])
+        self.assertNotIn("basetimestamp", second["fields"])
+
+
+@unittest.skipUnless(sys.platform.startswith("linux"), "inotify is Linux only")
+class InotifyWatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.content = os.path.join(self.tmp.name, "content")
+        os.mkdir(self.content)
+        self.watcher = sync_content.InotifyWatcher(self.content)
+        self.addCleanup(self.watcher.close)
+
+    def test_directory_moved_in_is_synced_and_watched(self):
+        outside = os.path.join(self.tmp.name, "incoming")
+        os.mkdir(outside)
+        Path(outside, "Moved.mediawiki").write_text("moved", encoding="utf-8")
+        moved = os.path.join(self.content, "incoming")
+        os.rename(outside, moved)
+
+        self.assertEqual(self.watcher.wait_for_changes(0.1), {os.path.join(moved, "Moved.mediawiki")})
+
+        Path(moved, "Later.mediawiki").write_text("later", encoding="utf-8")
+        self.assertEqual(self.watcher.wait_for_changes(0.1), {os.path.join(moved, "Later.mediawiki")})
+
+    def test_queue_overflow_asks_for_a_rescan(self):
+        read_fd, write_fd = os.pipe()
+        self.addCleanup(os.close, write_fd)
+        os.close(self.watcher.fd)
+        self.watcher.fd = read_fd
+        os.write(write_fd, self.watcher.EVENT_HEADER.pack(-1, self.watcher.IN_Q_OVERFLOW, 0, 0))
+
+        self.assertEqual(self.watcher.wait_for_changes(0.05), set())
+        self.assertTrue(self.watcher.overflowed)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""
+benchmark.py - Benchmark the post-commit pipeline on synthetic repositories
+
+Builds throwaway repositories of the requested sizes with git fast-import
+(commits, pull request merges, branches, remote-tracking branches, tags and
+existing docs/commit-logs entries), installs the hooks from this checkout and
+times each hook stage:
+
+  post-commit         the installed hook template, end to end
+  update-readme.sh    README index update for one new commit log
+  timeline            generate_git_timeline.py, incremental
+  timeline-full       generate_git_timeline.py with TIMELINE_FULL_REBUILD=true
+
+Every stage runs after a fresh commit. Besides wall times, the number of git
+subprocesses per stage (counted in a separate run through a logging git
+wrapper) and the peak RSS of the largest process are recorded. Results are
+written as JSON, for example:
+
+  python3 scripts/post-commit/benchmark.py --commits 1000 10000 --output bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import List, NamedTuple, Optional
+
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+TEMPLATES_DIR = SCRIPT_DIR.parent.parent / "developer-setup" / "templates"
+BRANCH = "main"
+FIRST_COMMIT_TIME = 1700000000
+SIDE_REF = "refs/bench/pull-request"
+STAGES = ("post-commit", "update-readme.sh", "timeline", "timeline-full")
+
+
+class RepoSpec(NamedTuple):
+    commits: int
+    branches: int
+    remote_branches: int
+    tags: int
+    existing_logs: int
+    merge_every: int
+
+
+class StageRun(NamedTuple):
+    seconds: float
+    peak_rss_kb: Optional[int]
+
+
+def git(repo, *args, **kwargs):
+    return subprocess.run(["git", "-C", str(repo), *args], check=True, capture_output=True, text=True, **kwargs)
+
+
+def fast_import_stream(spec):
+    """Yield the fast-import commands for a linear history with periodic pull request merges."""
+    def data(text):
+        raw = text.encode("utf-8")
+        return b"data %d\n%s\n" % (len(raw), raw)
+
+    def person(role, when):
+        return f"{role} Bench User <bench@example.com> {when} +0000\n".encode()
+
+    mark = 0
+    head = None
+    for number in range(1, spec.commits + 1):
+        when = FIRST_COMMIT_TIME + number * 60
+        if spec.merge_every and number % spec.merge_every == 0 and head:
+            # A side commit on a temporary ref, merged back like a pull request
+            mark += 1
+            side = mark
+            yield f"commit {SIDE_REF}\nmark :{side}\n".encode()
+            yield person("author", when) + person("committer", when)
+            yield data(f"Feature work {number}")
+            yield f"from :{head}\nM 100644 inline features/feature-{number}.txt\n".encode()
+            yield data(f"feature {number}\n")
+            mark += 1
+            yield f"commit refs/heads/{BRANCH}\nmark :{mark}\n".encode()
+            yield person("author", when) + person("committer", when)
+            yield data(f"Merge pull request #{number} from bench/feature-{number}")
+            yield f"from :{head}\nmerge :{side}\n".encode()
+        else:
+            mark += 1
+            yield f"commit refs/heads/{BRANCH}\nmark :{mark}\n".encode()
+            yield person("author", when) + person("committer", when)
+            yield data(f"Change {number}: update module {number % 100}")
+            if head:
+                yield f"from :{head}\n".encode()
+            yield f"M 100644 inline src/module-{number % 100}.txt\n".encode()
+            yield data(f"revision {number}\n")
+        head = mark
+
+    def spread(count):
+        return [max(1, mark * (index + 1) // (count + 1)) for index in range(count)]
+
+    for index, at in enumerate(spread(spec.branches)):
+        yield f"reset refs/heads/feature/bench-{index:05d}\nfrom :{at}\n\n".encode()
+    for index, at in enumerate(spread(spec.remote_branches)):
+        yield f"reset refs/remotes/origin/bench-{index:05d}\nfrom :{at}\n\n".encode()
+    for index, at in enumerate(spread(spec.tags)):
+        yield f"tag v0.{index}.0\nfrom :{at}\n".encode()
+        yield person("tagger", FIRST_COMMIT_TIME + at * 60)
+        yield data(f"Release 0.{index}.0")
+
+
+def install_hooks(repo):
+    """Copy the pipeline scripts into the repository and install the hook templates."""
+    shutil.copytree(SCRIPT_DIR, repo / "scripts" / "post-commit", ignore=shutil.ignore_patterns("__pycache__"))
+    hooks_dir = Path(git(repo, "rev-parse", "--absolute-git-dir").stdout.strip()) / "hooks"
+    hooks_dir.mkdir(exist_ok=True)
+    for template in TEMPLATES_DIR.iterdir():
+        hook = hooks_dir / template.name
+        content = template.read_text(encoding="utf-8")
+        content = content.replace("{{VERSION}}", "bench").replace("{{INSTALLER}}", "benchmark.py")
+        hook.write_text(content, encoding="utf-8", newline="\n")
+        hook.chmod(0o755)
+
+
+def write_existing_logs(repo, count):
+    """Write minimal commit logs for the newest ``count`` commits, as earlier hook runs would have."""
+    log_dir = repo / "docs" / "commit-logs" / BRANCH
+    log_dir.mkdir(parents=True, exist_ok=True)
+    if not count:
+        return
+    for line in git(repo, "log", f"-{count}", "--format=%H%x00%an%x00%ad%x00%s", "--date=iso").stdout.splitlines():
+        hash, author, date, subject = line.split("\0")
+        (log_dir / f"{hash[:8]}.md").write_text(
+            f"# Commit Log\n\n- **Commit Hash:**   `{hash}`\n- **Author:**        {author}\n"
+            f"- **Date:**          {date}\n- **Message:**\n\n  {subject}\n",
+            encoding="utf-8", newline="\n"
+        )
+
+
+def build_repo(path, spec):
+    """Create a synthetic repository at ``path`` and return how long that took."""
+    start = time.monotonic()
+    subprocess.run(["git", "init", "-q", "-b", BRANCH, str(path)], check=True)
+    git(path, "config", "user.name", "Bench User")
+    git(path, "config", "user.email", "bench@example.com")
+    git(path, "remote", "add", "origin", "git@github.com:bench/synthetic.git")
+    process = subprocess.Popen(["git", "-C", str(path), "fast-import", "--quiet"], stdin=subprocess.PIPE)
+    for chunk in fast_import_stream(spec):
+        process.stdin.write(chunk)
+    process.stdin.close()
+    if process.wait() != 0:
+        raise RuntimeError("git fast-import failed")
+    git(path, "update-ref", "-d", SIDE_REF)
+    git(path, "reset", "-q", "--hard", BRANCH)
+
+    install_hooks(path)
+    write_existing_logs(path, spec.existing_logs)
+    git(path, "add", "--all")
+    git(path, "-c", "core.hooksPath=/dev/null", "commit", "-q", "-m", "Add post-commit pipeline")
+    return time.monotonic() - start
+
+
+def make_commit(repo, number):
+    """Commit a change without running hooks, so a stage has exactly one new commit to handle."""
+    bench_file = repo / "bench.txt"
+    bench_file.write_text(f"run {number}\n", encoding="utf-8")
+    git(repo, "add", "bench.txt")
+    git(repo, "-c", "core.hooksPath=/dev/null", "commit", "-q", "-m", f"Benchmark commit {number}", "--", "bench.txt")
+    return git(repo, "rev-parse", "HEAD").stdout.strip()
+
+
+def stage_command(repo, stage, commit_hash):
+    """Return the command and extra environment that run one stage."""
+    env = {"BRANCH_NAME": BRANCH, "REPO_ROOT": str(repo)}
+    scripts = repo / "scripts" / "post-commit"
+    if stage == "post-commit":
+        hooks_dir = Path(git(repo, "rev-parse", "--absolute-git-dir").stdout.strip()) / "hooks"
+        return ["bash", str(hooks_dir / "post-commit")], {}
+    if stage == "update-readme.sh":
+        # Give it a new log to index, as the engine would have written
+        log_dir = repo / "docs" / "commit-logs" / BRANCH
+        (log_dir / f"{commit_hash[:8]}.md").write_text(f"# Commit Log\n\n`{commit_hash}`\n", encoding="utf-8")
+        return ["bash", str(scripts / "update-readme.sh")], env
+    if stage == "timeline":
+        return [sys.executable, str(scripts / "generate_git_timeline.py"), "--stage-only"], env
+    if stage == "timeline-full":
+        return [sys.executable, str(scripts / "generate_git_timeline.py"), "--stage-only"], {
+            **env, "TIMELINE_FULL_REBUILD": "true"
+        }
+    raise ValueError(stage)
+
+
+def run_stage(repo, command, env):
+    """Run one stage and return its wall time and the peak RSS of its largest process."""
+    start = time.monotonic()
+    process = subprocess.Popen(
+        command, cwd=repo, env={**os.environ, **env},
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    if hasattr(os, "wait4"):
+        _, status, usage = os.wait4(process.pid, 0)
+        seconds = time.monotonic() - start
+        returncode = os.waitstatus_to_exitcode(status)
+        process.returncode = returncode
+        stderr = process.stderr.read()
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        peak_rss_kb = usage.ru_maxrss // 1024 if sys.platform == "darwin" else usage.ru_maxrss
+    else:
+        stderr = process.communicate()[1]
+        seconds = time.monotonic() - start
+        returncode = process.returncode
+        peak_rss_kb = None
+    process.stderr.close()
+    if returncode != 0:
+        raise RuntimeError(f"{' '.join(command)} failed:\n{stderr.decode('utf-8', 'replace')}")
+    return StageRun(seconds, peak_rss_kb)
+
+
+def count_git_calls(repo, command, env, wrapper_dir):
+    """Run a stage through the logging git wrapper and return the git subcommands it ran."""
+    log_path = wrapper_dir / "calls.log"
+    log_path.write_text("", encoding="utf-8")
+    run_stage(repo, command, {
+        **env,
+        "PATH": f"{wrapper_dir}{os.pathsep}{os.environ.get('PATH', '')}",
+        "BENCH_GIT_LOG": str(log_path),
+    })
+    calls = {}
+    for line in log_path.read_text(encoding="utf-8").splitlines():
+        calls[line] = calls.get(line, 0) + 1
+    return calls
+
+
+def make_git_wrapper(directory):
+    """Create a ``git`` wrapper that logs the subcommand name of every call."""
+    real_git = shutil.which("git")
+    wrapper = directory / "git"
+    wrapper.write_text(
+        "#!/bin/sh\n"
+        "for arg in \"$@\"; do\n"
+        "  case \"$prev\" in -C|-c) prev=; continue;; esac\n"
+        "  case \"$arg\" in -C|-c) prev=$arg;; -*) ;; *) echo \"$arg\" >> \"$BENCH_GIT_LOG\"; break;; esac\n"
+        "done\n"
+        f"exec '{real_git}' \"$@\"\n",
+        encoding="utf-8"
+    )
+    wrapper.chmod(0o755)
+
+
+def summarize(runs: List[StageRun], git_calls):
+    seconds = [run.seconds for run in runs]
+    peak_rss = [run.peak_rss_kb for run in runs if run.peak_rss_kb is not None]
+    return {
+        "runs": [round(value, 4) for value in seconds],
+        "median_seconds": round(statistics.median(seconds), 4),
+        "min_seconds": round(min(seconds), 4),
+        "max_seconds": round(max(seconds), 4),
+        "peak_rss_kb": max(peak_rss) if peak_rss else None,
+        "git_subprocesses": sum(git_calls.values()),
+        "git_commands": dict(sorted(git_calls.items())),
+    }
+
+
+def benchmark_repo(workdir, spec, runs, stages):
+    repo = workdir / f"repo-{spec.commits}"
+    print(f"🏗️  Building synthetic repository with {spec.commits} commits: {repo}")
+    build_seconds = build_repo(repo, spec)
+    wrapper_dir = workdir / "git-wrapper"
+    wrapper_dir.mkdir(exist_ok=True)
+    make_git_wrapper(wrapper_dir)
+
+    # The first hook run builds README and timeline from scratch; record it separately
+    command, env = stage_command(repo, "post-commit", make_commit(repo, 0))
+    cold = run_stage(repo, command, env)
+
+    results = {}
+    number = 1
+    for stage in stages:
+        stage_runs = []
+        for _ in range(runs):
+            command, env = stage_command(repo, stage, make_commit(repo, number))
+            number += 1
+            stage_runs.append(run_stage(repo, command, env))
+        command, env = stage_command(repo, stage, make_commit(repo, number))
+        number += 1
+        git_calls = count_git_calls(repo, command, env, wrapper_dir)
+        results[stage] = summarize(stage_runs, git_calls)
+        print(f"   ⏱️  {stage:<18} median {results[stage]['median_seconds']:.3f}s, "
+              f"{results[stage]['git_subprocesses']} git calls, peak RSS {results[stage]['peak_rss_kb']} KB")
+
+    return {
+        "spec": spec._asdict(),
+        "build_seconds": round(build_seconds, 3),
+        "cold_post_commit_seconds": round(cold.seconds, 4),
+        "stages": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the post-commit pipeline on synthetic repositories")
+    parser.add_argument('--commits', type=int, nargs='+', default=[1000],
+                        help='Repository sizes to benchmark, e.g. 1000 10000 100000')
+    parser.add_argument('--branches', type=int, default=50, help='Local branches per repository')
+    parser.add_argument('--remote-branches', type=int, default=200, help='Remote-tracking branches per repository')
+    parser.add_argument('--tags', type=int, default=50, help='Annotated tags per repository')
+    parser.add_argument('--existing-logs', type=int, default=500,
+                        help='Existing docs/commit-logs entries (capped at the number of commits)')
+    parser.add_argument('--merge-every', type=int, default=20,
+                        help='Make every Nth commit a pull request merge (0 for none)')
+    parser.add_argument('--runs', type=int, default=3, help='Timed runs per stage')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES), help='Stages to time')
+    parser.add_argument('--output', help='Write the JSON results here instead of stdout')
+    parser.add_argument('--workdir', help='Build the repositories here (default: a temporary directory)')
+    parser.add_argument('--keep', action='store_true', help='Keep the generated repositories')
+    args = parser.parse_args()
+
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="post-commit-bench-")).resolve()
+    workdir.mkdir(parents=True, exist_ok=True)
+    try:
+        results = {
+            "generated_at": datetime.now().isoformat(timespec="seconds"),
+            "git_version": subprocess.run(["git", "--version"], capture_output=True, text=True).stdout.strip(),
+            "python_version": platform.python_version(),
+            "platform": platform.platform(),
+            "runs_per_stage": args.runs,
+            "repositories": [],
+        }
+        for commits in args.commits:
+            spec = RepoSpec(
+                commits=commits,
+                branches=args.branches,
+                remote_branches=args.remote_branches,
+                tags=args.tags,
+                existing_logs=min(args.existing_logs, commits),
+                merge_every=args.merge_every,
+            )
+            results["repositories"].append(benchmark_repo(workdir, spec, max(1, args.runs), args.stages))
+    finally:
+        if args.keep:
+            print(f"📂 Repositories kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8", newline="\n") as output_file:
+            output_file.write(output + "\n")
+        print(f"✅ Benchmark results written to {args.output}")
+    else:
+        print(output)
+    return 0
+
+
+# Main entry point
+if __name__ == "__main__":
+    sys.exit(main())
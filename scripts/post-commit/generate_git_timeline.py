@@ -1,30 +1,265 @@
 #!/usr/bin/env python3
 # Last changes by Johan Sörell
+import argparse
 import subprocess
 import os
 import sys
 import io
+import itertools
+import json
+import shutil
+import tempfile
 from datetime import datetime
 from pathlib import Path
+from typing import List, NamedTuple, Optional
 
 # Set UTF-8 encoding for stdout to handle emojis on Windows
 if sys.platform == 'win32':
     sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 
 from githooks_utils import (
+    TRACE,
     assert_inside_repo,
+    count_commits,
+    ensure_commit_graph,
+    get_git_dir,
     get_repo_root,
+    history_rewritten,
+    is_pull_request,
+    load_repo_snapshot,
     run_git_command,
-    get_repo_url,
-    get_branches,
-    get_tags,
-    get_pull_requests,
-    get_commits,
+    run_traced,
 )
 
 
-def generate_git_timeline():
-    branch_name = os.getenv("BRANCH_NAME")
+STATE_FILE_NAME = ".timeline-state.json"
+STATE_VERSION = 1
+PR_HEADING = "## 🔀 Pull Requests (PRs)\n"
+PR_TABLE_HEADER = "| **Commit** | **Message** | **Date** |\n|------------|-------------|---------|\n"
+COMMIT_HEADING = "## 📁 Commit Log\n"
+SUMMARY_HEADING = "## ✅ Summary\n"
+SHARD_DIR_NAME = "timeline"
+SHARD_TABLE_HEADER = "| **Page** | **Commits** |\n|----------|-------------|\n"
+DEFAULT_BASE_BRANCH = "main"
+
+
+class TimelineScope(NamedTuple):
+    name: str                  # Recorded in the state; a different scope forces a rebuild
+    revisions: List[str]       # git log arguments selecting the commits
+    ref_patterns: List[str]    # for-each-ref patterns for the branch and tag tables
+    tips: Optional[List[str]]  # Where the walk starts (None: every ref listed)
+    windowed: bool             # A commit-count or date window is applied
+
+
+def load_state(state_file_path):
+    """Load the last processed ref tips, or None if there is no usable state."""
+    try:
+        with open(state_file_path, "r", encoding="utf-8") as state_file:
+            state = json.load(state_file)
+    except (OSError, ValueError):
+        return None
+    if state.get("version") != STATE_VERSION or not state.get("tips"):
+        return None
+    return state
+
+
+def save_state(state_file_path, tips, scope, shard_mode, commit_count, shard_counts):
+    """Persist the ref tips the report was generated from, plus the scope and shard layout."""
+    state = {
+        "version": STATE_VERSION,
+        "tips": sorted(set(tips)),
+        "scope": scope.name,
+        "shard": str(shard_mode or "none"),
+        "commits": commit_count,
+        "shards": dict(sorted(shard_counts.items())),
+    }
+    with open(state_file_path, "w", encoding="utf-8", newline="\n") as state_file:
+        json.dump(state, state_file, indent=2)
+        state_file.write("\n")
+
+
+def get_shard_mode():
+    """Read TIMELINE_SHARD: unset for one report, "month", or a number of commits per page."""
+    value = os.getenv("TIMELINE_SHARD", "").strip().lower()
+    if value in ("", "none"):
+        return None
+    if value == "month":
+        return "month"
+    if value.isdigit() and int(value) > 0:
+        return int(value)
+    print(f"❌ ERROR: Invalid TIMELINE_SHARD value: {value}")
+    sys.exit(1)
+
+
+def get_scope(branch_name):
+    """Read TIMELINE_SCOPE, TIMELINE_MAX_COMMITS and TIMELINE_SINCE into a TimelineScope.
+
+    TIMELINE_SCOPE is "all" (every ref, the default), "branch" (BRANCH_NAME
+    only), "merge-base" (BRANCH_NAME down to its merge-base with
+    TIMELINE_BASE_BRANCH) or "refs:<glob>[,<glob>...]".
+    """
+    value = os.getenv("TIMELINE_SCOPE", "all").strip() or "all"
+    branch_rev = "HEAD" if branch_name == "HEAD" else f"refs/heads/{branch_name}"
+    if value == "all":
+        revisions, ref_patterns, tip_args = ["--all"], [], None
+    elif value == "branch":
+        revisions, ref_patterns, tip_args = [branch_rev], ["refs/heads", "refs/tags"], [branch_rev]
+    elif value == "merge-base":
+        base_branch = os.getenv("TIMELINE_BASE_BRANCH", DEFAULT_BASE_BRANCH)
+        revisions, ref_patterns, tip_args = [branch_rev], ["refs/heads", "refs/tags"], [branch_rev]
+        merge_base = run_traced(
+            ["git", "merge-base", f"refs/heads/{base_branch}", branch_rev], capture_output=True, text=True
+        ).stdout.strip()
+        if not merge_base:
+            print(f"⚠️ No merge-base with {base_branch}; showing the whole branch.")
+        elif merge_base != run_git_command(["git", "rev-parse", branch_rev])[0]:
+            # Stop at the merge-base, including it
+            revisions.append(f"^{merge_base}^@")
+        value = f"merge-base:{base_branch}"
+    elif value.startswith("refs:") and value[len("refs:"):]:
+        globs = [glob for glob in value[len("refs:"):].split(",") if glob]
+        revisions = [f"--glob={glob}" for glob in globs]
+        ref_patterns = globs + ["refs/tags"]
+        tip_args = revisions
+    else:
+        print(f"❌ ERROR: Invalid TIMELINE_SCOPE value: {value}")
+        sys.exit(1)
+
+    window = []
+    max_commits = os.getenv("TIMELINE_MAX_COMMITS", "").strip()
+    if max_commits:
+        if not max_commits.isdigit() or int(max_commits) == 0:
+            print(f"❌ ERROR: Invalid TIMELINE_MAX_COMMITS value: {max_commits}")
+            sys.exit(1)
+        window.append(f"--max-count={max_commits}")
+    since = os.getenv("TIMELINE_SINCE", "").strip()
+    if since:
+        window.append(f"--since={since}")
+
+    tips = run_git_command(["git", "rev-parse", *tip_args]) if tip_args else None
+    return TimelineScope(
+        name=" ".join([value, *window]),
+        revisions=revisions + window,
+        ref_patterns=ref_patterns,
+        tips=tips,
+        windowed=bool(window),
+    )
+
+
+def report_is_reusable(timeline_file_path):
+    """Check that an existing report has the sections an incremental run merges into."""
+    expected = [PR_HEADING, COMMIT_HEADING, SUMMARY_HEADING]
+    try:
+        with open(timeline_file_path, "r", encoding="utf-8") as md_file:
+            for line in md_file:
+                if expected and line == expected[0]:
+                    expected.pop(0)
+    except OSError:
+        return False
+    return not expected
+
+
+def iter_report_section(timeline_file_path, heading, end_heading, skip=0):
+    """Yield the lines of an existing report section without loading the whole file.
+
+    The blank line separating the section from ``end_heading`` is not yielded.
+    """
+    with open(timeline_file_path, "r", encoding="utf-8") as md_file:
+        for line in md_file:
+            if line == heading:
+                break
+        for _ in range(skip):
+            next(md_file, None)
+        pending = None
+        for line in md_file:
+            if line == end_heading:
+                return
+            if pending is not None:
+                yield pending
+            pending = line
+
+
+def format_pull_request(pr):
+    return f"| {pr.short_hash} | {pr.subject} | {pr.date} |\n"
+
+
+def format_commit(commit, repo_url):
+    hash = commit.short_hash
+    return (
+        f"### ✅ Commit: [{hash}]({repo_url}/commit/{hash})\n"
+        f"- **Date:** {commit.date}\n- **Author:** {commit.author}\n- **Message:** {commit.subject}\n\n"
+    )
+
+
+def shard_header(key):
+    return f"# 📁 Commit Log: {key}\n\n[⬅️ Back to the timeline](../git_timeline_report.md)\n\n"
+
+
+def write_shards(shard_dir, snapshot, shard_mode, first_ordinal, shard_counts, pull_requests, incremental):
+    """Stream commits into their shard pages and return how many were written.
+
+    Only shards that receive new commits are rewritten. ``first_ordinal`` is the
+    position of the newest commit counted from the oldest, used for numbered pages.
+    """
+    os.makedirs(shard_dir, exist_ok=True)
+    written = {}
+    shard_file = None
+    current_key = None
+    ordinal = first_ordinal
+    try:
+        for commit in snapshot.commits:
+            if shard_mode == "month":
+                key = commit.date[:7]
+            else:
+                key = f"page-{(ordinal - 1) // shard_mode + 1:04d}"
+            ordinal -= 1
+            if key != current_key:
+                if shard_file:
+                    shard_file.close()
+                tmp_path = os.path.join(shard_dir, f"{key}.md.tmp")
+                shard_file = open(tmp_path, "a" if key in written else "w", encoding="utf-8", newline="\n")
+                if key not in written:
+                    shard_file.write(shard_header(key))
+                    written[key] = 0
+                current_key = key
+            shard_file.write(format_commit(commit, snapshot.repo_url))
+            written[key] += 1
+            if is_pull_request(commit):
+                pull_requests.append(commit)
+    finally:
+        if shard_file:
+            shard_file.close()
+
+    header_lines = shard_header("").count("\n")
+    for key, count in written.items():
+        shard_path = os.path.join(shard_dir, f"{key}.md")
+        tmp_path = f"{shard_path}.tmp"
+        if incremental and os.path.exists(shard_path):
+            with open(shard_path, "r", encoding="utf-8") as old_shard, \
+                    open(tmp_path, "a", encoding="utf-8", newline="\n") as shard_file:
+                shard_file.writelines(itertools.islice(old_shard, header_lines, None))
+        os.replace(tmp_path, shard_path)
+        TRACE.record_written(shard_path)
+        shard_counts[key] = shard_counts.get(key, 0) + count
+    return sum(written.values())
+
+
+def remove_stale_shards(shard_dir, shard_counts):
+    """Delete shard pages left over from a previous layout or rewritten history."""
+    if not os.path.isdir(shard_dir):
+        return
+    for name in os.listdir(shard_dir):
+        if name.endswith(".md") and name[:-3] not in shard_counts:
+            os.remove(os.path.join(shard_dir, name))
+
+
+def generate_git_timeline(branch_name=None, repo_root=None, stage_only=False):
+    """Generate the timeline report and stage it.
+
+    With ``stage_only=True`` the output is only staged and the staged paths are
+    returned, so the caller can include them in its own follow-up commit.
+    """
+    branch_name = branch_name or os.getenv("BRANCH_NAME")
 
     if not branch_name:
         print("❌ ERROR: Branch name not set. Exiting.")
@@ -32,56 +267,141 @@ def generate_git_timeline():
 
     print(f"🌿 Active Branch: {branch_name}")
 
-    repo_root = get_repo_root()
+    repo_root = repo_root or get_repo_root()
     log_dir = os.path.join(repo_root, "docs", "commit-logs", branch_name)
     assert_inside_repo(Path(log_dir), Path(repo_root), "Timeline output directory")
 
     os.makedirs(log_dir, exist_ok=True)
     timeline_file_path = os.path.join(log_dir, "git_timeline_report.md")
+    state_file_path = os.path.join(log_dir, STATE_FILE_NAME)
+
+    shard_mode = get_shard_mode()
+    shard_dir = os.path.join(log_dir, SHARD_DIR_NAME)
+    # Every walk below (merge-base, history check, log, count) reads the commit-graph
+    with TRACE.stage("timeline.commit-graph"):
+        ensure_commit_graph()
+    scope = get_scope(branch_name)
+
+    # Only walk commits added since the last run, unless history was rewritten.
+    # A windowed report is rebuilt every time so old commits drop out of it.
+    state = None if os.getenv("TIMELINE_FULL_REBUILD") == "true" else load_state(state_file_path)
+    incremental = (
+        bool(state)
+        and not scope.windowed
+        and state.get("scope", "all") == scope.name
+        and state.get("shard", "none") == str(shard_mode or "none")
+        and report_is_reusable(timeline_file_path)
+    )
+    if incremental:
+        with TRACE.stage("timeline.history-check"):
+            # Saved tips must still be in the scope, not merely held by some other ref
+            rewritten = history_rewritten(state["tips"], ("--all",) if scope.tips is None else scope.tips)
+        if rewritten:
+            print("♻️  History was rewritten since the last run. Rebuilding timeline.")
+            incremental = False
+
+    exclude = state["tips"] if incremental else None
+    snapshot = load_repo_snapshot(exclude=exclude, revisions=scope.revisions, ref_patterns=scope.ref_patterns)
+    commit_count = state.get("commits", 0) if incremental else 0
+    shard_counts = dict(state.get("shards", {})) if incremental else {}
+
+    # Write into a temporary file so the previous report can be streamed into it
+    tmp_file_path = timeline_file_path + ".tmp"
+    with TRACE.stage("timeline.render"), \
+            open(tmp_file_path, "w", encoding="utf-8", newline="\n") as md_file, \
+            tempfile.TemporaryFile("w+", encoding="utf-8", newline="\n") as commit_spool:
+        # The commit log is streamed to shard pages or a spool file; merges are collected for the PR section
+        pull_requests = []
+        if shard_mode:
+            first_ordinal = commit_count + count_commits(exclude, scope.revisions) if shard_mode != "month" else 0
+            new_commit_count = write_shards(
+                shard_dir, snapshot, shard_mode, first_ordinal, shard_counts, pull_requests, incremental
+            )
+            commit_spool.write(SHARD_TABLE_HEADER)
+            for key in sorted(shard_counts, reverse=True):
+                commit_spool.write(f"| [{key}](./{SHARD_DIR_NAME}/{key}.md) | {shard_counts[key]} |\n")
+        else:
+            new_commit_count = 0
+            for commit in snapshot.commits:
+                commit_spool.write(format_commit(commit, snapshot.repo_url))
+                if is_pull_request(commit):
+                    pull_requests.append(commit)
+                new_commit_count += 1
+        commit_count += new_commit_count
+        if incremental:
+            print(f"➕ Adding {new_commit_count} new commit(s) to the timeline")
 
-    # Start generating the Markdown content
-    with open(timeline_file_path, "w", encoding="utf-8", newline="\n") as md_file:
         md_file.write("# 📊 Git Commit Timeline\n\n")
         md_file.write(f"> **Generated on:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
         md_file.write(f"> **Branch:** `{branch_name}`\n\n")
+        if scope.name != "all":
+            md_file.write(f"> **Scope:** `{scope.name}`\n\n")
 
         # Branches Section
         md_file.write("## 📦 Branches\n| **Branch Name** | **Last Commit** | **Author** |\n|----------------|--------------|------------|\n")
-        for branch in get_branches():
-            md_file.write(f"| {branch} |\n")
+        for branch in snapshot.branches:
+            md_file.write(f"| {branch.name} | {branch.short_hash} | {branch.author} |\n")
 
         # Tags Section
         md_file.write("\n## 🏷️ Tags\n| **Tag** | **Commit Hash** | **Tagged On** |\n|--------|----------------|--------------|\n")
-        for tag in get_tags():
-            md_file.write(f"| {tag} |\n")
+        for tag in snapshot.tags:
+            md_file.write(f"| {tag.name} | {tag.short_hash} | {tag.tagged_on} |\n")
 
         # PR Section (Simulated using commit messages)
-        md_file.write("\n## 🔀 Pull Requests (PRs)\n| **Commit** | **Message** | **Date** |\n|------------|-------------|---------|\n")
-        for pr in get_pull_requests():
-            md_file.write(f"| {pr} |\n")
-
-        # Commits Section
-        md_file.write("\n## 📁 Commit Log\n")
-        for commit in get_commits():
-            hash, message, author, date = commit.split(" | ")
-            repo_url = get_repo_url()
-            md_file.write(f"### ✅ Commit: [{hash}]({repo_url}/commit/{hash})\n")
-            md_file.write(f"- **Date:** {date}\n- **Author:** {author}\n- **Message:** {message}\n\n")
-
-        md_file.write("\n## ✅ Summary\n- **Here you can put a summary if you like.**\n- **PR and MR inclusion (simulated).**\n")
-
-    subprocess.run(["git", "add", timeline_file_path], check=True)
-    commit_hash = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True).stdout.strip()
+        md_file.write("\n" + PR_HEADING + PR_TABLE_HEADER)
+        for pr in pull_requests:
+            md_file.write(format_pull_request(pr))
+        if incremental:
+            md_file.writelines(iter_report_section(timeline_file_path, PR_HEADING, COMMIT_HEADING, skip=2))
+
+        # Commits Section (an index of shard pages in sharded mode)
+        md_file.write("\n" + COMMIT_HEADING)
+        commit_spool.seek(0)
+        shutil.copyfileobj(commit_spool, md_file)
+        if incremental and not shard_mode:
+            md_file.writelines(iter_report_section(timeline_file_path, COMMIT_HEADING, SUMMARY_HEADING))
+
+        md_file.write("\n" + SUMMARY_HEADING)
+        md_file.write("- **Here you can put a summary if you like.**\n- **PR and MR inclusion (simulated).**\n")
+
+    os.replace(tmp_file_path, timeline_file_path)
+    if not incremental:
+        remove_stale_shards(shard_dir, shard_counts)
+    save_state(state_file_path, snapshot.tips if scope.tips is None else scope.tips,
+               scope, shard_mode, commit_count, shard_counts)
+    TRACE.record_written(timeline_file_path, state_file_path)
+
+    staged_paths = [timeline_file_path, state_file_path]
+    if os.path.isdir(shard_dir):
+        staged_paths.append(shard_dir)
+    run_traced(["git", "add", "--all", "--", *staged_paths], check=True)
+    if stage_only:
+        print(f"✅ Timeline report generated and staged: {timeline_file_path}")
+        return staged_paths
+
+    commit_hash = run_traced(["git", "rev-parse", "HEAD"], capture_output=True, text=True).stdout.strip()
     commit_message = f"Update commit timeline: {commit_hash}"
 
     try:
-        subprocess.run(["git", "commit", "-m", commit_message], check=True)
+        run_traced(["git", "commit", "-m", commit_message], check=True)
         print(f"📈 Git Timeline Updated for branch: {branch_name}")
         print(f"✅ Timeline report generated: {timeline_file_path}")
     except subprocess.CalledProcessError:
         print("⚠️ No changes detected. Skipping commit.")
+    return staged_paths
 
 
 # Main entry point
 if __name__ == "__main__":
-    generate_git_timeline()
+    parser = argparse.ArgumentParser(description="Generate the git timeline report for BRANCH_NAME")
+    parser.add_argument(
+        '--stage-only',
+        action='store_true',
+        default=os.getenv("TIMELINE_STAGE_ONLY") == "true",
+        help='Only stage the report; leave committing to the caller (env: TIMELINE_STAGE_ONLY=true)'
+    )
+    args = parser.parse_args()
+    try:
+        generate_git_timeline(stage_only=args.stage_only)
+    finally:
+        TRACE.write(get_git_dir(), mode="timeline")
@@ -0,0 +1,681 @@
+#!/usr/bin/env python3
+"""
+post_commit.py - In-process post-commit engine
+
+Gathers the details of new commits once and writes the per-commit logs,
+the branch README index and the git timeline from them. The post-commit
+hook template only launches this script.
+
+Every commit is first appended to a queue under the git directory. A worker
+holding the worker lock drains the queue, so commits that arrive while
+another run is busy are picked up instead of skipped. With
+GIT_HOOKS_ASYNC=true the worker runs in the background and the commit
+returns immediately.
+
+Commits replayed by a rebase or a cherry-pick/revert sequence are not
+processed one by one. A rebase is logged in one batch from the post-rewrite
+hook, and a cherry-pick sequence is drained by its last commit.
+"""
+import argparse
+import heapq
+import io
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import List, NamedTuple
+
+# Set UTF-8 encoding for stdout to handle emojis on Windows
+if sys.platform == 'win32':
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+
+from githooks_utils import (
+    TRACE,
+    assert_inside_repo,
+    get_git_dir,
+    get_repo_root,
+    lookup_commits,
+    run_git_command,
+    run_traced,
+)
+from generate_git_timeline import generate_git_timeline
+
+
+LOG_UPDATE_PREFIX = "Update commit logs:"
+README_INDEX_NAME = ".readme-index"
+REPORT_FILES = ("README.md", "git_timeline_report.md")
+DETAILS_FORMAT = "%x00%x01%H%x00%an%x00%ad%x00%s%x00%B%x00"
+ENGINE_ENV = "POST_COMMIT_ENGINE"
+QUEUE_NAME = "post-commit.queue"
+WORKER_LOCK_NAME = "post-commit.worker.lock"
+WORKER_LOG_NAME = "post-commit.worker.log"
+STALE_LOCK_SECONDS = 600
+MAX_BATCH_ATTEMPTS = 3
+DEFAULT_SETTLE_SECONDS = 2.0
+REBASE_STATE_DIRS = ("rebase-merge", "rebase-apply")
+PICK_STATE_FILES = ("CHERRY_PICK_HEAD", "REVERT_HEAD")
+
+
+class CommitDetails(NamedTuple):
+    hash: str
+    branch: str
+    author: str
+    date: str
+    subject: str
+    message: str
+    changed_files: List[str]
+
+
+def get_commit_details(revisions, branch_name):
+    """Read everything the logs need about the given commits with one git call."""
+    output = run_traced(
+        ["git", "log", "--no-walk=unsorted", "--stdin", "--cc", "--name-status", "--date=iso",
+         f"--format={DETAILS_FORMAT}"],
+        capture_output=True, text=True, encoding="utf-8", errors="replace",
+        input="".join(f"{revision}\n" for revision in revisions)
+    )
+    if output.returncode != 0:
+        print(f"❌ Git command failed: git log --no-walk\n{output.stderr}")
+        sys.exit(1)
+    details = []
+    for record in output.stdout.split("\0\x01")[1:]:
+        hash, author, date, subject, message, changed = record.split("\0", 5)
+        details.append(CommitDetails(
+            hash=hash,
+            branch=branch_name,
+            author=author,
+            date=date,
+            subject=subject,
+            message=message.rstrip("\n"),
+            changed_files=changed.strip("\n").split("\n"),
+        ))
+    return details
+
+
+def write_commit_log(log_dir, details):
+    """Write the Markdown log for a single commit and return its path."""
+    log_file_path = os.path.join(log_dir, f"{details.hash[:8]}.md")
+    with open(log_file_path, "w", encoding="utf-8", newline="\n") as log_file:
+        log_file.write("# Commit Log\n\n---\n\n## Commit Details\n\n")
+        log_file.write(f"- **Commit Hash:**   `{details.hash}`\n")
+        log_file.write(f"- **Branch:**        `{details.branch}`\n")
+        log_file.write(f"- **Author:**        {details.author}\n")
+        log_file.write(f"- **Date:**          {details.date}\n")
+        log_file.write("- **Message:**\n\n")
+        log_file.write(f"  {details.message}\n\n---\n\n## Changed Files:\n\n")
+        for line in details.changed_files:
+            log_file.write(f"- `{line}`\n")
+        log_file.write("\n---\n")
+    TRACE.record_written(log_file_path)
+    return log_file_path
+
+
+def readme_row(name, date, author, subject):
+    """Format one README index line: DATE|HASH|AUTHOR|MESSAGE."""
+    return f"{date[:16]}|{name}|{author}|{subject}\n"
+
+
+def update_readme(log_dir, branch_name, known_commits):
+    """Update the sorted README index and regenerate README.md from it.
+
+    Also run on its own through update-readme.sh. Rows for ``known_commits``
+    come from the details already in memory, so in the common case no git
+    calls are needed at all.
+    """
+    readme_file_path = os.path.join(log_dir, "README.md")
+    index_file_path = os.path.join(log_dir, README_INDEX_NAME)
+    log_names = [
+        name[:-3] for name in os.listdir(log_dir)
+        if name.endswith(".md") and not name.startswith(".") and name not in REPORT_FILES
+    ]
+
+    index = None
+    if os.getenv("README_FULL_REBUILD") != "true":
+        try:
+            with open(index_file_path, "r", encoding="utf-8") as index_file:
+                index = index_file.readlines()
+        except OSError:
+            index = None
+
+    # A log file that disappeared means the index no longer matches the logs
+    if index is not None:
+        indexed_names = {line.split("|", 2)[1] for line in index if "|" in line}
+        if not indexed_names.issubset(log_names):
+            index = None
+
+    missing = log_names if index is None else [name for name in log_names if name not in indexed_names]
+    known = {details.hash[:8]: details for details in known_commits}
+    new_rows = []
+    for name in missing:
+        if name in known:
+            details = known[name]
+            new_rows.append(readme_row(name, details.date, details.author, details.subject))
+    missing = [name for name in missing if name not in known]
+    if missing:
+        for name, commit in lookup_commits(missing).items():
+            new_rows.append(readme_row(name, commit.date, commit.author, commit.subject))
+    new_rows.sort(reverse=True)
+    index = list(heapq.merge(index or [], new_rows, reverse=True))
+
+    with open(index_file_path, "w", encoding="utf-8", newline="\n") as index_file:
+        index_file.writelines(index)
+
+    with open(readme_file_path, "w", encoding="utf-8", newline="\n") as readme_file:
+        readme_file.write(f"# Commit Log for Branch: `{branch_name}`\n\n")
+        readme_file.write(f"This file provides a summary of all commits in the branch `{branch_name}`.\n")
+        readme_file.write("Each commit links to its detailed log.\n\n")
+        readme_file.write("### 📈 [View Full Git Timeline](./git_timeline_report.md)\n\n")
+        readme_file.write("| Commit Hash | Date & Time       | Author       | Message           |\n")
+        readme_file.write("|-------------|------------------|--------------|-------------------|\n")
+        for line in index:
+            date, name, author, message = line.rstrip("\n").split("|", 3)
+            readme_file.write(f"| [{name}](./{name}.md) | {date} | {author} | {message} |\n")
+
+    TRACE.record_written(index_file_path, readme_file_path)
+    print(f"✅ README.md has been generated and updated: {readme_file_path}")
+    return [readme_file_path, index_file_path]
+
+
+def commit_outputs(paths, message, git_dir, attempts=5):
+    """Make the single follow-up commit for the generated files, if any changed.
+
+    Only the given paths are committed, so anything else the developer has
+    staged stays staged. A busy index (another git command holding
+    index.lock) is retried a few times; any other failure, such as a hook
+    rejecting the commit, is not. Returns None if the commit failed.
+    """
+    if run_traced(["git", "diff", "--cached", "--quiet", "--", *paths]).returncode == 0:
+        print("⚠️ No changes detected. Skipping commit.")
+        return False
+    if any(os.path.exists(os.path.join(git_dir, name)) for name in PICK_STATE_FILES):
+        commit_with_temporary_index(paths, message, git_dir)
+        print("DEBUG: Successfully committed staged files.")
+        return True
+    for attempt in range(attempts):
+        result = run_traced(
+            ["git", "commit", "--quiet", "-m", message, "--", *paths], capture_output=True, text=True
+        )
+        if result.returncode == 0:
+            print("DEBUG: Successfully committed staged files.")
+            return True
+        if "index.lock" not in result.stderr or attempt == attempts - 1:
+            break
+        time.sleep(0.5 * (attempt + 1))
+    print(f"❌ ERROR: Could not commit the generated logs:\n{result.stdout}{result.stderr}")
+    return None
+
+
+def commit_with_temporary_index(paths, message, git_dir):
+    """Commit ``paths`` on top of HEAD without ``git commit``.
+
+    git refuses partial commits while CHERRY_PICK_HEAD or REVERT_HEAD exists,
+    and those files are only removed after post-commit has run.
+    """
+    index_path = os.path.join(git_dir, "post-commit.index")
+    env = {**os.environ, "GIT_INDEX_FILE": index_path}
+    parent = run_git_command(["git", "rev-parse", "HEAD"])[0]
+    try:
+        run_traced(["git", "read-tree", parent], env=env, check=True)
+        run_traced(["git", "add", "--all", "--", *paths], env=env, check=True)
+        tree = run_traced(["git", "write-tree"], env=env, capture_output=True, text=True, check=True).stdout.strip()
+    finally:
+        if os.path.exists(index_path):
+            os.remove(index_path)
+    commit = run_traced(
+        ["git", "commit-tree", tree, "-p", parent, "-m", message],
+        capture_output=True, text=True, check=True
+    ).stdout.strip()
+    run_traced(["git", "update-ref", "-m", f"commit: {message}", "HEAD", commit, parent], check=True)
+
+
+def process_batch(repo_root, git_dir, entries):
+    """Write logs, README and timeline for a batch of (hash, branch) entries in one pass."""
+    by_branch = {}
+    for hash, branch in entries:
+        hashes = by_branch.setdefault(branch, [])
+        if hash not in hashes:
+            hashes.append(hash)
+
+    print("🎯 Commit Process Started...\n")
+    output_paths = []
+    logged = []
+    for branch, hashes in by_branch.items():
+        # Skip log update commits
+        with TRACE.stage("details"):
+            commits = [
+                details for details in get_commit_details(hashes, branch)
+                if not details.message.startswith(LOG_UPDATE_PREFIX)
+            ]
+        if not commits:
+            continue
+
+        log_dir = os.path.join(repo_root, "docs", "commit-logs", branch)
+        assert_inside_repo(Path(log_dir), Path(repo_root), "Commit log directory")
+        os.makedirs(log_dir, exist_ok=True)
+
+        with TRACE.stage("logs"):
+            for details in commits:
+                log_file_path = write_commit_log(log_dir, details)
+                output_paths.append(log_file_path)
+                print(f"📌 Commit message logged to: {os.path.relpath(log_file_path, repo_root)}")
+        print()
+
+        with TRACE.stage("readme"):
+            output_paths += update_readme(log_dir, branch, commits)
+            run_traced(["git", "add", "--all", "--", *output_paths], check=True)
+
+        # The timeline is only staged so everything goes into one follow-up commit
+        with TRACE.stage("timeline"):
+            output_paths += generate_git_timeline(branch, repo_root, stage_only=True)
+        if not os.path.isfile(os.path.join(log_dir, "git_timeline_report.md")):
+            print("ERROR: git_timeline_report.md was not generated.")
+            return 1
+        logged += commits
+
+    if not logged:
+        print("Skipping log update commit.")
+        return 0
+    print(f"✅ Successfully staged logs for {len(logged)} commit(s)")
+
+    if len(logged) == 1:
+        message = f"{LOG_UPDATE_PREFIX} {logged[0].hash}"
+    else:
+        message = f"{LOG_UPDATE_PREFIX} {logged[-1].hash} (+{len(logged) - 1} more)"
+    with TRACE.stage("commit"):
+        if commit_outputs(output_paths, message, git_dir) is None:
+            return 1
+
+    # Optional Push: Controlled by an environment variable
+    if os.getenv("GIT_AUTO_PUSH") == "true":
+        with TRACE.stage("push"):
+            run_traced(["git", "push", "origin", logged[-1].branch], check=True)
+        print("DEBUG: Successfully pushed changes to remote.")
+    else:
+        print("🚀 [INFO] Auto-push disabled. Skipping push step.")
+    return 0
+
+
+class LockFile:
+    """A lock file created with O_EXCL that records the owner's pid."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def acquire(self):
+        for _ in range(2):
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if not self.is_stale():
+                    return False
+                self.break_lock()
+                continue
+            with os.fdopen(fd, "w") as lock_file:
+                lock_file.write(str(os.getpid()))
+            return True
+        return False
+
+    def release(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def break_lock(self):
+        print(f"⚠️ Removing stale lock: {self.path}")
+        self.release()
+
+    def is_stale(self):
+        """A lock is stale when it is missing, very old or its owner has exited."""
+        try:
+            age = time.time() - os.path.getmtime(self.path)
+            with open(self.path, "r") as lock_file:
+                pid = int(lock_file.read().strip() or 0)
+        except (OSError, ValueError):
+            return True
+        if age > STALE_LOCK_SECONDS:
+            return True
+        if sys.platform == "win32" or not pid:
+            # os.kill() would terminate the process on Windows, so rely on age only
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            return False
+        return False
+
+
+class CommitQueue:
+    """Append-only queue of "hash branch" lines under the git directory."""
+
+    def __init__(self, git_dir):
+        self.path = os.path.join(git_dir, QUEUE_NAME)
+        self.processing_path = f"{self.path}.processing"
+        # Entries for branches other than the checked-out one wait here
+        self.deferred_path = f"{self.path}.deferred"
+        self.failed_path = f"{self.path}.failed"
+        self.attempts_path = f"{self.processing_path}.attempts"
+        self.lock = LockFile(f"{self.path}.lock")
+
+    def _locked(self, action):
+        deadline = time.time() + 5
+        while not self.lock.acquire():
+            if time.time() > deadline:
+                self.lock.break_lock()
+            time.sleep(0.02)
+        try:
+            return action()
+        finally:
+            self.lock.release()
+
+    def push(self, hashes, branch):
+        def append():
+            with open(self.path, "a", encoding="utf-8", newline="\n") as queue_file:
+                queue_file.writelines(f"{hash} {branch}\n" for hash in hashes)
+        self._locked(append)
+
+    def _move_lines(self, source, target):
+        """Append ``source`` to ``target`` and remove it (call with the lock held)."""
+        if os.path.exists(source):
+            with open(source, "r", encoding="utf-8") as source_file, \
+                    open(target, "a", encoding="utf-8", newline="\n") as target_file:
+                target_file.write(source_file.read())
+            os.remove(source)
+
+    def defer(self, entries, remaining):
+        """Keep entries for another branch until that branch is checked out again.
+
+        The processing batch is rewritten with the ``remaining`` entries, so a
+        retried batch does not defer the same entries twice.
+        """
+        def move():
+            with open(self.deferred_path, "a", encoding="utf-8", newline="\n") as deferred_file:
+                deferred_file.writelines(f"{hash} {branch}\n" for hash, branch in entries)
+            with open(self.processing_path, "w", encoding="utf-8", newline="\n") as processing_file:
+                processing_file.writelines(f"{hash} {branch}\n" for hash, branch in remaining)
+        self._locked(move)
+
+    def restore_deferred(self):
+        """Put deferred entries back in the queue so the next drain looks at them again."""
+        self._locked(lambda: self._move_lines(self.deferred_path, self.path))
+
+    def has_entries(self):
+        return os.path.exists(self.path) or os.path.exists(self.processing_path)
+
+    def wait_until_settled(self, settle_seconds):
+        """Wait until nothing has been queued for ``settle_seconds`` so a burst becomes one batch."""
+        while True:
+            try:
+                quiet_for = time.time() - os.path.getmtime(self.path)
+            except FileNotFoundError:
+                return
+            if quiet_for >= settle_seconds:
+                return
+            time.sleep(settle_seconds - quiet_for)
+
+    def take(self):
+        """Move queued entries to the processing file and return them.
+
+        Entries stay in the processing file until done() is called, so a
+        crashed run is retried by the next worker.
+        """
+        self._locked(lambda: self._move_lines(self.path, self.processing_path))
+        try:
+            with open(self.processing_path, "r", encoding="utf-8") as processing_file:
+                lines = processing_file.read().splitlines()
+        except FileNotFoundError:
+            return []
+        return [tuple(line.split(" ", 1)) for line in lines if " " in line]
+
+    def done(self):
+        for path in (self.processing_path, self.attempts_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def failed(self):
+        """Count a failed attempt at the processing batch; set it aside after MAX_BATCH_ATTEMPTS."""
+        try:
+            with open(self.attempts_path, "r", encoding="utf-8") as attempts_file:
+                attempts = int(attempts_file.read().strip() or 0) + 1
+        except (OSError, ValueError):
+            attempts = 1
+        if attempts < MAX_BATCH_ATTEMPTS:
+            with open(self.attempts_path, "w", encoding="utf-8") as attempts_file:
+                attempts_file.write(str(attempts))
+            return
+        self._locked(lambda: self._move_lines(self.processing_path, self.failed_path))
+        self.done()
+        print(f"⚠️ Giving up on this batch after {attempts} failed attempts; "
+              f"its commits were moved to {self.failed_path}")
+
+
+def rebase_in_progress(git_dir):
+    return any(os.path.isdir(os.path.join(git_dir, name)) for name in REBASE_STATE_DIRS)
+
+
+def sequence_pending(git_dir):
+    """Return True while a rebase or a cherry-pick/revert sequence still has commits to replay.
+
+    The sequencer todo list still includes the commit being made, so the last
+    commit of a sequence sees a single entry.
+    """
+    if rebase_in_progress(git_dir):
+        return True
+    try:
+        with open(os.path.join(git_dir, "sequencer", "todo"), "r", encoding="utf-8") as todo_file:
+            steps = [line for line in todo_file if line.strip() and not line.startswith("#")]
+    except OSError:
+        return False
+    return len(steps) > 1
+
+
+def drop_unreachable(entries):
+    """Drop queued commits that are no longer on their branch.
+
+    Commits queued during a cherry-pick or rebase stay queued after
+    --abort or --quit, although the branch no longer contains them.
+    """
+    by_branch = {}
+    for hash, branch in entries:
+        by_branch.setdefault(branch, []).append(hash)
+    unreachable = set()
+    for branch, hashes in by_branch.items():
+        tip = "HEAD" if branch == "HEAD" else f"refs/heads/{branch}"
+        result = run_traced(
+            ["git", "rev-list", "--stdin", "--not", tip],
+            input="\n".join(hashes) + "\n", capture_output=True, text=True,
+        )
+        if result.returncode != 0:
+            print(f"⚠️ Dropping {len(hashes)} queued commit(s): {branch} or its commits no longer exist")
+            unreachable.update((hash, branch) for hash in hashes)
+            continue
+        left_behind = set(hashes) & set(result.stdout.split())
+        if left_behind:
+            print(f"🗑️ Dropping {len(left_behind)} queued commit(s) no longer on {branch}")
+            unreachable.update((hash, branch) for hash in left_behind)
+    return [entry for entry in entries if entry not in unreachable]
+
+
+def drain_queue(repo_root, git_dir, settle_seconds=0, check_sequence=False):
+    """Process queued commits until the queue is empty, unless another worker is running."""
+    queue = CommitQueue(git_dir)
+    worker_lock = LockFile(os.path.join(git_dir, WORKER_LOCK_NAME))
+    queue.restore_deferred()
+    # Re-check after releasing: a commit may be queued just before the lock is dropped
+    while queue.has_entries():
+        if not worker_lock.acquire():
+            print("⏳ Another post-commit worker is running; it will pick up this commit.")
+            return 0
+        try:
+            while queue.has_entries():
+                queue.wait_until_settled(settle_seconds)
+                if check_sequence and sequence_pending(git_dir):
+                    # The hook run at the end of the sequence drains the queue
+                    print("⏸️ Rebase or cherry-pick in progress; leaving commits queued.")
+                    return 0
+                entries = queue.take()
+                if entries:
+                    entries = drop_unreachable(entries)
+                # The follow-up commit goes onto HEAD, so only log the checked-out branch now
+                current_branch = run_git_command(["git", "rev-parse", "--abbrev-ref", "HEAD"])[0] if entries else None
+                other_branches = [entry for entry in entries if entry[1] != current_branch]
+                entries = [entry for entry in entries if entry[1] == current_branch]
+                if other_branches:
+                    print(f"⏭️ Leaving {len(other_branches)} commit(s) of other branches queued until they are checked out.")
+                    queue.defer(other_branches, entries)
+                if entries:
+                    TRACE.commits += len(entries)
+                    try:
+                        status = process_batch(repo_root, git_dir, entries)
+                    except subprocess.CalledProcessError as e:
+                        print(f"❌ ERROR: {' '.join(e.cmd)} failed with exit code {e.returncode}")
+                        status = 1
+                    if status:
+                        queue.failed()
+                        return status
+                queue.done()
+        finally:
+            worker_lock.release()
+    return 0
+
+
+def spawn_worker(repo_root, git_dir):
+    """Start a detached background worker that drains the queue."""
+    if not LockFile(os.path.join(git_dir, WORKER_LOCK_NAME)).is_stale():
+        print("⏳ Post-commit worker already running; commit queued.")
+        return
+    options = {}
+    if sys.platform == "win32":
+        options["creationflags"] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        options["start_new_session"] = True
+    with open(os.path.join(git_dir, WORKER_LOG_NAME), "a", encoding="utf-8") as worker_log:
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--worker"],
+            cwd=repo_root,
+            stdin=subprocess.DEVNULL,
+            stdout=worker_log,
+            stderr=subprocess.STDOUT,
+            env={**os.environ, "REPO_ROOT": repo_root, "REPO_GIT_DIR": git_dir},
+            **options,
+        )
+    print(f"🕒 Post-commit work queued; running in the background (log: {WORKER_LOG_NAME})")
+
+
+def read_rebased_commits(stream):
+    """Return the new commit hashes from post-rewrite input ("old new" per line), in order."""
+    hashes = []
+    for line in stream:
+        fields = line.split()
+        if len(fields) >= 2 and fields[1] not in hashes:
+            hashes.append(fields[1])
+    return hashes
+
+
+def hook_launch_seconds():
+    """Time from the hook template starting (HOOK_STARTED_AT) until now, if known."""
+    started_at = os.getenv("HOOK_STARTED_AT", "").replace(",", ".")
+    try:
+        return max(0.0, time.time() - float(started_at))
+    except ValueError:
+        return None
+
+
+def run_post_commit(worker=False, rebased=False):
+    # Child git commands inherit this, so the hook skips the engine's own commits
+    os.environ[ENGINE_ENV] = "1"
+    launch_seconds = None if worker else hook_launch_seconds()
+
+    repo_root = os.getenv("REPO_ROOT") or get_repo_root()
+    git_dir = os.getenv("REPO_GIT_DIR") or get_git_dir()
+    os.chdir(repo_root)
+
+    if launch_seconds is not None:
+        TRACE.add_stage("launch", launch_seconds)
+    mode = "worker" if worker else "rebased" if rebased else "hook"
+    try:
+        return queue_and_process(repo_root, git_dir, worker, rebased)
+    finally:
+        TRACE.write(git_dir, mode=mode, commits=TRACE.commits)
+
+
+def run_update_readme():
+    """Regenerate the README of BRANCH_NAME from its commit logs and stage it (update-readme.sh)."""
+    branch_name = os.getenv("BRANCH_NAME")
+    if not branch_name:
+        print("ERROR: Branch name not set. Exiting.")
+        return 1
+    repo_root = os.getenv("REPO_ROOT") or get_repo_root()
+    git_dir = os.getenv("REPO_GIT_DIR") or get_git_dir()
+    os.chdir(repo_root)
+    log_dir = os.path.join(repo_root, "docs", "commit-logs", branch_name)
+    assert_inside_repo(Path(log_dir), Path(repo_root), "README directory")
+    if not os.path.isdir(log_dir):
+        print(f"ERROR: Log directory {log_dir} does not exist. Skipping README update.")
+        return 1
+
+    try:
+        with TRACE.stage("readme"):
+            paths = update_readme(log_dir, branch_name, [])
+            if run_traced(["git", "add", "--", *paths]).returncode != 0:
+                print(f"ERROR: Failed to stage {paths[0]}")
+                return 1
+        print("✅ README.md successfully added for commit.")
+        return 0
+    finally:
+        TRACE.write(git_dir, mode="update-readme.sh")
+
+
+def queue_and_process(repo_root, git_dir, worker, rebased):
+    """Queue the new commit(s) and drain the queue in this process or a background worker."""
+    if worker:
+        settle_seconds = float(os.getenv("GIT_HOOKS_ASYNC_DELAY", DEFAULT_SETTLE_SECONDS))
+        return drain_queue(repo_root, git_dir, settle_seconds, check_sequence=True)
+
+    branch_name = os.getenv("BRANCH_NAME") or run_git_command(["git", "rev-parse", "--abbrev-ref", "HEAD"])[0]
+    if rebased:
+        # Called from post-rewrite: the rebase state still exists but all commits are in place
+        CommitQueue(git_dir).push(read_rebased_commits(sys.stdin), branch_name)
+    elif rebase_in_progress(git_dir):
+        print("⏸️ Rebase in progress; commit logs will be written when it finishes.")
+        return 0
+    else:
+        commit_hash = os.getenv("COMMIT_HASH") or run_git_command(["git", "rev-parse", "HEAD"])[0]
+        CommitQueue(git_dir).push([commit_hash], branch_name)
+        if sequence_pending(git_dir):
+            print("⏸️ Cherry-pick in progress; commit queued for the end of the sequence.")
+            return 0
+
+    if os.getenv("GIT_HOOKS_ASYNC") == "true":
+        spawn_worker(repo_root, git_dir)
+        return 0
+    return drain_queue(repo_root, git_dir)
+
+
+# Main entry point
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write commit logs, README and timeline for new commits")
+    parser.add_argument(
+        '--worker',
+        action='store_true',
+        help='Drain queued commits instead of queueing HEAD (used by the background worker)'
+    )
+    parser.add_argument(
+        '--rebased',
+        action='store_true',
+        help='Queue the rewritten commits listed on stdin (used by the post-rewrite hook)'
+    )
+    parser.add_argument(
+        '--readme-only',
+        action='store_true',
+        help='Only regenerate and stage the README of BRANCH_NAME (used by update-readme.sh)'
+    )
+    args = parser.parse_args()
+    if args.readme_only:
+        sys.exit(run_update_readme())
+    sys.exit(run_post_commit(worker=args.worker, rebased=args.rebased))
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""Tests for generate_git_timeline.py that run it against a throwaway repository."""
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "generate_git_timeline.py")
+
+
+class TimelineScopeTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.repo = self.tmp.name
+        self.env = {
+            **os.environ,
+            "GIT_AUTHOR_NAME": "Test", "GIT_AUTHOR_EMAIL": "test@example.com",
+            "GIT_COMMITTER_NAME": "Test", "GIT_COMMITTER_EMAIL": "test@example.com",
+            "GIT_CONFIG_GLOBAL": os.devnull, "GIT_CONFIG_NOSYSTEM": "1",
+            "GIT_HOOKS_TRACE": "false", "GIT_HOOKS_CACHE": "off", "GIT_HOOKS_COMMIT_GRAPH": "false",
+            "BRANCH_NAME": "main", "TIMELINE_SCOPE": "branch",
+        }
+        for key in ("GIT_DIR", "GIT_WORK_TREE", "TIMELINE_MAX_COMMITS", "TIMELINE_SINCE", "TIMELINE_FULL_REBUILD"):
+            self.env.pop(key, None)
+        self.git("init", "-q", "-b", "main")
+        self.git("remote", "add", "origin", "https://github.com/acme/demo.git")
+
+    def git(self, *args):
+        return subprocess.run(
+            ["git", *args], cwd=self.repo, env=self.env, check=True, capture_output=True, text=True
+        ).stdout.strip()
+
+    def commit(self, message):
+        self.git("commit", "-q", "--allow-empty", "-m", message)
+        return self.git("rev-parse", "HEAD")
+
+    def timeline(self):
+        subprocess.run(
+            [sys.executable, SCRIPT, "--stage-only"], cwd=self.repo, env=self.env,
+            check=True, capture_output=True, text=True
+        )
+        with open(os.path.join(self.repo, "docs", "commit-logs", "main", "git_timeline_report.md"),
+                  "r", encoding="utf-8") as report:
+            return report.read()
+
+    def test_amended_commit_held_by_remote_ref_leaves_branch_scope(self):
+        self.commit("first")
+        amended = self.commit("second")
+        self.timeline()
+        self.git("update-ref", "refs/remotes/origin/main", amended)
+
+        self.git("commit", "-q", "--amend", "--allow-empty", "-m", "second, amended")
+        report = self.timeline()
+
+        self.assertNotIn(amended[:7], report)
+        self.assertIn(self.git("rev-parse", "--short=7", "HEAD"), report)
+
+    def test_new_commit_is_added_incrementally(self):
+        first = self.commit("first")
+        self.timeline()
+        second = self.commit("second")
+        report = self.timeline()
+
+        self.assertIn(first[:7], report)
+        self.assertIn(second[:7], report)
+
+
+if __name__ == "__main__":
+    unittest.main()
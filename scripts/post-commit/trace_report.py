@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+trace_report.py - Summarise the post-commit hook trace
+
+Every hook run appends one line to .git/post-commit.trace.jsonl (rotated to
+.1, .2, ... when it grows). This prints p50/p95 wall times per stage over the
+most recent runs, plus git subprocess counts and bytes written:
+
+  python3 scripts/post-commit/trace_report.py --last 50
+"""
+import argparse
+import io
+import json
+import math
+import os
+import sys
+
+# Set UTF-8 encoding for stdout to handle emojis on Windows
+if sys.platform == 'win32':
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+
+from githooks_utils import TRACE_FILE_NAME, TRACE_KEEP_FILES, get_git_dir
+
+
+def read_runs(git_dir, mode=None):
+    """Read trace records from the rotated files, oldest first."""
+    trace_path = os.path.join(git_dir, TRACE_FILE_NAME)
+    paths = [f"{trace_path}.{number}" for number in range(TRACE_KEEP_FILES, 0, -1)] + [trace_path]
+    runs = []
+    for path in paths:
+        try:
+            with open(path, "r", encoding="utf-8") as trace_file:
+                for line in trace_file:
+                    try:
+                        run = json.loads(line)
+                    except ValueError:
+                        continue
+                    if mode is None or run.get("mode") == mode:
+                        runs.append(run)
+        except OSError:
+            continue
+    return runs
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+def summarize(runs):
+    """Return {row name: {"runs", "p50", "p95", "max"}} for stages, totals and counters."""
+    series = {}
+    for run in runs:
+        series.setdefault("total", []).append(run.get("total_seconds", 0.0))
+        for stage, seconds in run.get("stages", {}).items():
+            series.setdefault(f"stage {stage}", []).append(seconds)
+        if "git_calls" in run:
+            series.setdefault("git calls", []).append(run["git_calls"])
+            series.setdefault("git seconds", []).append(run.get("git_seconds", 0.0))
+        series.setdefault("bytes written", []).append(run.get("bytes_written", 0))
+    return {
+        name: {
+            "runs": len(values),
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "max": max(values),
+        }
+        for name, values in series.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarise recent post-commit hook runs from the trace in .git")
+    parser.add_argument('--last', type=int, default=50, help='Number of most recent runs to include')
+    parser.add_argument('--mode', choices=['hook', 'worker', 'rebased', 'timeline', 'update-readme.sh'],
+                        help='Only include runs of this kind')
+    parser.add_argument('--json', action='store_true', help='Print the summary as JSON')
+    args = parser.parse_args()
+
+    git_dir = os.getenv("REPO_GIT_DIR") or get_git_dir()
+    runs = read_runs(git_dir, args.mode)[-args.last:] if args.last > 0 else []
+    if not runs:
+        print(f"⚠️ No hook runs recorded in {os.path.join(git_dir, TRACE_FILE_NAME)}")
+        return 1
+
+    summary = summarize(runs)
+    if args.json:
+        print(json.dumps({"runs": len(runs), "since": runs[0].get("time"), "rows": summary}, indent=2))
+        return 0
+
+    print(f"📊 {len(runs)} hook run(s) since {runs[0].get('time')}\n")
+    print(f"| {'**Measure**':<28} | {'**Runs**':>8} | {'**p50**':>10} | {'**p95**':>10} | {'**Max**':>10} |")
+    print(f"|{'-' * 30}|{'-' * 10}|{'-' * 12}|{'-' * 12}|{'-' * 12}|")
+    for name, row in summary.items():
+        if name.startswith("stage ") or name in ("total", "git seconds"):
+            values = [f"{row[key]:.3f}s" for key in ("p50", "p95", "max")]
+        else:
+            values = [f"{row[key]:.0f}" for key in ("p50", "p95", "max")]
+        print(f"| {name:<28} | {row['runs']:>8} | {values[0]:>10} | {values[1]:>10} | {values[2]:>10} |")
+    return 0
+
+
+# Main entry point
+if __name__ == "__main__":
+    sys.exit(main())